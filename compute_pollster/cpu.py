@@ -0,0 +1,155 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import functools
+
+import ceilometer
+from ceilometer.compute import plugin
+from ceilometer.compute.pollsters import snapshot
+from ceilometer.compute.pollsters import template
+from ceilometer.compute.pollsters import workers
+from ceilometer.compute.virt import inspector as virt_inspector
+from ceilometer.openstack.common.gettextutils import _
+from ceilometer.openstack.common import log
+from ceilometer import sample
+
+LOG = log.getLogger(__name__)
+
+# Fields read with the same domain calls, inspected together by whichever
+# CPU pollster needs an instance first.
+CPU_FIELDS = ['cpu', 'cpu_util']
+
+
+class CPUPollster(plugin.ComputePollster):
+
+    def get_samples(self, manager, cache, resources):
+        self._inspection_duration = self._record_poll_time()
+        return workers.iter_samples(
+            functools.partial(self._get_instance_samples, manager, cache),
+            resources)
+
+    def _get_instance_samples(self, manager, cache, instance):
+        LOG.debug(_('checking instance %s'), instance.id)
+        try:
+            cpu_info = snapshot.get_snapshot(
+                manager, cache, instance, CPU_FIELDS,
+                self._inspection_duration).cpu
+            if cpu_info is None:
+                raise ceilometer.NotImplementedError
+            LOG.debug(_("CPUTIME USAGE: %(instance)s %(time)d"),
+                      {'instance': instance.id, 'time': cpu_info.time})
+            cpu_num = {'cpu_number': cpu_info.number}
+            yield template.make_sample(
+                cache, instance,
+                name='cpu',
+                type=sample.TYPE_CUMULATIVE,
+                unit='ns',
+                volume=cpu_info.time,
+                additional_metadata=cpu_num,
+            )
+        except virt_inspector.InstanceNotFoundException as err:
+            # Instance was deleted while getting samples. Ignore it.
+            LOG.debug(_('Exception while getting samples %s'), err)
+        except virt_inspector.HypervisorUnavailableException as err:
+            # The inspector logged the failed connection attempt.
+            LOG.debug(_('Hypervisor unavailable: %s'), err)
+        except ceilometer.NotImplementedError:
+            # Selected inspector does not implement this pollster.
+            LOG.debug(_('Obtaining CPU time is not implemented for %s'
+                        ), manager.inspector.__class__.__name__)
+        except Exception as err:
+            LOG.exception(_('could not get CPU time for %(id)s: %(e)s'),
+                          {'id': instance.id, 'e': err})
+
+
+class CPUUtilPollster(plugin.ComputePollster):
+
+    def get_samples(self, manager, cache, resources):
+        self._inspection_duration = self._record_poll_time()
+        return workers.iter_samples(
+            functools.partial(self._get_instance_samples, manager, cache),
+            resources)
+
+    def _get_instance_samples(self, manager, cache, instance):
+        LOG.debug(_('Checking CPU util for instance %s'), instance.id)
+        try:
+            cpu_info = snapshot.get_snapshot(
+                manager, cache, instance, CPU_FIELDS,
+                self._inspection_duration).cpu_util
+            if cpu_info is None:
+                # A rate needs two samples, the first poll has none.
+                LOG.debug(_('No CPU util yet for instance %s'),
+                          instance.id)
+                return
+            LOG.debug(_("CPU UTIL: %(instance)s %(util)d"),
+                      {'instance': instance.id, 'util': cpu_info.util})
+            yield template.make_sample(
+                cache, instance,
+                name='cpu_util',
+                type=sample.TYPE_GAUGE,
+                unit='%',
+                volume=cpu_info.util,
+            )
+        except virt_inspector.InstanceNotFoundException as err:
+            # Instance was deleted while getting samples. Ignore it.
+            LOG.debug(_('Exception while getting samples %s'), err)
+        except virt_inspector.HypervisorUnavailableException as err:
+            # The inspector logged the failed connection attempt.
+            LOG.debug(_('Hypervisor unavailable: %s'), err)
+        except ceilometer.NotImplementedError:
+            # Selected inspector does not implement this pollster.
+            LOG.debug(_('Obtaining CPU Util is not implemented for %s'
+                        ), manager.inspector.__class__.__name__)
+        except Exception as err:
+            LOG.exception(_('Could not get CPU Util for %(id)s: %(e)s'),
+                          {'id': instance.id, 'e': err})
+
+
+class PerVCPUUtilPollster(plugin.ComputePollster):
+
+    def get_samples(self, manager, cache, resources):
+        self._inspection_duration = self._record_poll_time()
+        return workers.iter_samples(
+            functools.partial(self._get_instance_samples, manager, cache),
+            resources)
+
+    def _get_instance_samples(self, manager, cache, instance):
+        LOG.debug(_('Checking vCPU util for instance %s'), instance.id)
+        try:
+            vcpus = snapshot.get_snapshot(
+                manager, cache, instance, CPU_FIELDS + ['vcpu_util'],
+                self._inspection_duration).vcpu_util
+            if vcpus is None:
+                raise ceilometer.NotImplementedError
+            for vcpu_info in vcpus:
+                yield template.make_sample(
+                    cache, instance,
+                    name='cpu.vcpu.util',
+                    type=sample.TYPE_GAUGE,
+                    unit='%',
+                    volume=vcpu_info.util,
+                    resource_id="%s-vcpu%d" % (instance.id,
+                                               vcpu_info.number),
+                    additional_metadata={'vcpu': vcpu_info.number},
+                )
+        except virt_inspector.InstanceNotFoundException as err:
+            # Instance was deleted while getting samples. Ignore it.
+            LOG.debug(_('Exception while getting samples %s'), err)
+        except virt_inspector.HypervisorUnavailableException as err:
+            # The inspector logged the failed connection attempt.
+            LOG.debug(_('Hypervisor unavailable: %s'), err)
+        except ceilometer.NotImplementedError:
+            # Selected inspector does not implement this pollster.
+            LOG.debug(_('Obtaining vCPU Util is not implemented for %s'
+                        ), manager.inspector.__class__.__name__)
+        except Exception as err:
+            LOG.exception(_('Could not get vCPU Util for %(id)s: %(e)s'),
+                          {'id': instance.id, 'e': err})
@@ -19,32 +19,45 @@
 
 import abc
 import collections
+import functools
 
+from oslo.config import cfg
+from oslo.utils import timeutils
 import six
 
 import ceilometer
 from ceilometer.compute import plugin
+from ceilometer.compute.pollsters import snapshot
+from ceilometer.compute.pollsters import template
 from ceilometer.compute.pollsters import util
+from ceilometer.compute.pollsters import workers
 from ceilometer.compute.virt import inspector as virt_inspector
 from ceilometer.openstack.common.gettextutils import _
 from ceilometer.openstack.common import log
 from ceilometer import sample
 
 
-LOG = log.getLogger(__name__)
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
+LOG = log.getLogger(__name__)
 
-DiskIOData = collections.namedtuple(
-    'DiskIOData',
-    'r_bytes r_requests w_bytes w_requests per_disk_requests',
-)
+OPTS = [
+    cfg.BoolOpt('disk_pollster_suppress_unchanged',
+                default=False,
+                help='Skip the cumulative disk samples whose value did not '
+                     'change since they were last emitted, as for idle '
+                     'instances.'),
+    cfg.IntOpt('disk_pollster_heartbeat_cycles',
+               default=10,
+               help='Number of polling cycles after which an unchanged '
+                    'cumulative disk sample is emitted again anyway when '
+                    'disk_pollster_suppress_unchanged is set.'),
+]
 
-DiskRateData = collections.namedtuple('DiskRateData',
-                                      ['read_bytes_rate',
-                                       'read_requests_rate',
-                                       'write_bytes_rate',
-                                       'write_requests_rate',
-                                       'per_disk_rate'])
+cfg.CONF.register_opts(OPTS)
 
 
 DiskLatencyData = collections.namedtuple('DiskLatencyData',
@@ -55,15 +68,92 @@ DiskIOPSData = collections.namedtuple('DiskIOPSData',
                                       ['iops_count',
                                        'per_disk_iops'])
 
-DiskInfoData = collections.namedtuple('DiskInfoData',
-                                      ['capacity',
-                                       'allocation',
-                                       'physical',
-                                       'per_disk_info'])
+
+# Parts of the disk data, with the snapshot field each one comes from and
+# the columns it fills in the per-device records.
+#
+_DISK_PARTS = (
+    ('io', 'disks', ('read_bytes', 'read_requests',
+                     'write_bytes', 'write_requests')),
+    ('rates', 'disk_rates', ('read_bytes_rate', 'read_requests_rate',
+                             'write_bytes_rate', 'write_requests_rate')),
+    ('info', 'disk_info', ('capacity', 'allocation', 'physical')),
+)
+
+
+class _DiskRecord(object):
+    """All that is known of one disk, a column being None when unknown."""
+
+    __slots__ = (('device',) +
+                 tuple(column for part, field, columns in _DISK_PARTS
+                       for column in columns))
+
+    def __init__(self, device):
+        self.device = device
+        for column in self.__slots__[1:]:
+            setattr(self, column, None)
+
+
+class DiskData(object):
+    """All that was inspected of the disks of an instance in a cycle.
+
+    The data is kept as one record per device, and the totals of the
+    instance are summed from their columns when asked for.
+    """
+
+    __slots__ = ('parts', 'records')
+
+    def __init__(self, parts, records):
+        self.parts = parts
+        self.records = records
+
+    def values(self, column):
+        """Yield the (device, value) of the devices with a value."""
+        for record in self.records:
+            value = getattr(record, column)
+            if value is not None:
+                yield record.device, value
+
+    def devices(self, column):
+        return [device for device, value in self.values(column)]
+
+    def total(self, column):
+        return sum(value for device, value in self.values(column))
+
+
+def _make_disk_data(instance, snap):
+    """Build the DiskData of an instance in a single pass over its disks."""
+    sources = []
+    for part, field, columns in _DISK_PARTS:
+        devices = getattr(snap, field)
+        if devices is not None:
+            sources.append((part, dict((disk.device, info)
+                                       for disk, info in devices), columns))
+    records = []
+    for device in sorted(set().union(*[infos for p, infos, c in sources])):
+        record = _DiskRecord(device)
+        for part, infos, columns in sources:
+            info = infos.get(device)
+            if info is None:
+                continue
+            if part == 'io':
+                LOG.debug(_Base.DISKIO_USAGE_MESSAGE,
+                          instance, device, info.read_requests,
+                          info.read_bytes, info.write_requests,
+                          info.write_bytes, info.errors)
+            for column in columns:
+                setattr(record, column, getattr(info, column))
+        records.append(record)
+    return DiskData(frozenset(part for part, i, c in sources), records)
 
 
 @six.add_metaclass(abc.ABCMeta)
 class _Base(plugin.ComputePollster):
+    """Base of the disk pollsters, all of them views over one DiskData.
+
+    DISK_DATA names the part of the DiskData the pollster reports, as
+    listed in _DISK_PARTS.
+    """
 
     DISKIO_USAGE_MESSAGE = ' '.join(["DISKIO USAGE:",
                                      "%s %s:",
@@ -74,102 +164,125 @@ class _Base(plugin.ComputePollster):
                                      "errors=%d",
                                      ])
 
-    CACHE_KEY_DISK = 'diskio'
+    CACHE_KEY_DISK = 'disk'
+
+    DISK_DATA = 'io'
 
-    def _populate_cache(self, inspector, cache, instance, instance_name):
+    def __init__(self):
+        super(_Base, self).__init__()
+        # (resource_id, meter) -> [last emitted volume, cycle it was
+        # emitted, cycle it was last seen]
+        self._last_emitted = {}
+        self._cycle = 0
+        self.suppressed_samples = 0
+
+    def _populate_cache(self, manager, cache, instance):
         i_cache = cache.setdefault(self.CACHE_KEY_DISK, {})
-        if instance_name not in i_cache:
-            r_bytes = 0
-            r_requests = 0
-            w_bytes = 0
-            w_requests = 0
-            per_device_read_bytes = {}
-            per_device_read_requests = {}
-            per_device_write_bytes = {}
-            per_device_write_requests = {}
-            for disk, info in inspector.inspect_disks(instance_name):
-                LOG.debug(self.DISKIO_USAGE_MESSAGE,
-                          instance, disk.device, info.read_requests,
-                          info.read_bytes, info.write_requests,
-                          info.write_bytes, info.errors)
-                r_bytes += info.read_bytes
-                r_requests += info.read_requests
-                w_bytes += info.write_bytes
-                w_requests += info.write_requests
-                # per disk data
-                per_device_read_bytes[disk.device] = info.read_bytes
-                per_device_read_requests[disk.device] = info.read_requests
-                per_device_write_bytes[disk.device] = info.write_bytes
-                per_device_write_requests[disk.device] = info.write_requests
-            per_device_requests = {
-                'read_bytes': per_device_read_bytes,
-                'read_requests': per_device_read_requests,
-                'write_bytes': per_device_write_bytes,
-                'write_requests': per_device_write_requests,
-            }
-            i_cache[instance_name] = DiskIOData(
-                r_bytes=r_bytes,
-                r_requests=r_requests,
-                w_bytes=w_bytes,
-                w_requests=w_requests,
-                per_disk_requests=per_device_requests,
-            )
-        return i_cache[instance_name]
+        if instance.id not in i_cache:
+            snap = snapshot.get_snapshot(
+                manager, cache, instance,
+                ['disks', 'disk_rates', 'disk_info'],
+                self._inspection_duration)
+            i_cache[instance.id] = _make_disk_data(instance, snap)
+        return i_cache[instance.id]
 
     @abc.abstractmethod
-    def _get_samples(instance, c_data):
+    def _get_samples(cache, instance, c_data):
         """Return one or more Sample."""
 
     def get_samples(self, manager, cache, resources):
-        for instance in resources:
+        samples = self._iter_samples(manager, cache, resources)
+        if cfg.CONF.disk_pollster_suppress_unchanged:
+            samples = self._suppress_unchanged(samples)
+        return samples
+
+    def _iter_samples(self, manager, cache, resources):
+        self._inspection_duration = self._record_poll_time()
+        return workers.iter_samples(
+            functools.partial(self._get_instance_samples, manager, cache),
+            resources)
+
+    def _suppress_unchanged(self, samples):
+        """Skip the cumulative samples equal to the last one emitted.
+
+        Each sample is still emitted at least every
+        disk_pollster_heartbeat_cycles cycles.
+        """
+        self._cycle += 1
+        heartbeat = cfg.CONF.disk_pollster_heartbeat_cycles
+        suppressed = 0
+        for s in samples:
+            if s.type != sample.TYPE_CUMULATIVE:
+                yield s
+                continue
+            key = (s.resource_id, s.name)
+            last = self._last_emitted.get(key)
+            if (last is not None and last[0] == s.volume and
+                    self._cycle - last[1] < heartbeat):
+                last[2] = self._cycle
+                suppressed += 1
+                continue
+            self._last_emitted[key] = [s.volume, self._cycle, self._cycle]
+            yield s
+        # Forget the instances and devices that went away.
+        for key, last in list(self._last_emitted.items()):
+            if last[2] != self._cycle:
+                del self._last_emitted[key]
+        self.suppressed_samples += suppressed
+        LOG.debug(_('%(pollster)s suppressed %(count)d unchanged samples '
+                    '(%(total)d in total)'),
+                  {'pollster': self.__class__.__name__,
+                   'count': suppressed,
+                   'total': self.suppressed_samples})
+
+    def _get_instance_samples(self, manager, cache, instance):
+        try:
+            c_data = self._populate_cache(manager, cache, instance)
+            if self.DISK_DATA not in c_data.parts:
+                raise ceilometer.NotImplementedError
+            for s in self._get_samples(cache, instance, c_data):
+                yield s
+        except virt_inspector.InstanceNotFoundException as err:
+            # Instance was deleted while getting samples. Ignore it.
+            LOG.debug(_('Exception while getting samples %s'), err)
+        except virt_inspector.HypervisorUnavailableException as err:
+            # The inspector logged the failed connection attempt.
+            LOG.debug(_('Hypervisor unavailable: %s'), err)
+        except ceilometer.NotImplementedError:
+            # Selected inspector does not implement this pollster.
+            LOG.debug(_('%(inspector)s does not provide data for '
+                        ' %(pollster)s'),
+                      {'inspector': manager.inspector.__class__.__name__,
+                       'pollster': self.__class__.__name__})
+        except Exception as err:
             instance_name = util.instance_name(instance)
-            try:
-                c_data = self._populate_cache(
-                    manager.inspector,
-                    cache,
-                    instance,
-                    instance_name,
-                )
-                for s in self._get_samples(instance, c_data):
-                    yield s
-            except virt_inspector.InstanceNotFoundException as err:
-                # Instance was deleted while getting samples. Ignore it.
-                LOG.debug(_('Exception while getting samples %s'), err)
-            except ceilometer.NotImplementedError:
-                # Selected inspector does not implement this pollster.
-                LOG.debug(_('%(inspector)s does not provide data for '
-                            ' %(pollster)s'),
-                          {'inspector': manager.inspector.__class__.__name__,
-                           'pollster': self.__class__.__name__})
-            except Exception as err:
-                LOG.exception(_('Ignoring instance %(name)s: %(error)s'),
-                              {'name': instance_name, 'error': err})
+            LOG.exception(_('Ignoring instance %(name)s: %(error)s'),
+                          {'name': instance_name, 'error': err})
 
 
 class ReadRequestsPollster(_Base):
 
     @staticmethod
-    def _get_samples(instance, c_data):
-        return [util.make_sample_from_instance(
-            instance,
+    def _get_samples(cache, instance, c_data):
+        return [template.make_sample(
+            cache, instance,
             name='disk.read.requests',
             type=sample.TYPE_CUMULATIVE,
             unit='request',
-            volume=c_data.r_requests,
+            volume=c_data.total('read_requests'),
             additional_metadata={
-                'device': c_data.per_disk_requests['read_requests'].keys()}
+                'device': c_data.devices('read_requests')}
         )]
 
 
 class PerDeviceReadRequestsPollster(_Base):
 
     @staticmethod
-    def _get_samples(instance, c_data):
+    def _get_samples(cache, instance, c_data):
         samples = []
-        for disk, value in six.iteritems(c_data.per_disk_requests[
-                'read_requests']):
-            samples.append(util.make_sample_from_instance(
-                instance,
+        for disk, value in c_data.values('read_requests'):
+            samples.append(template.make_sample(
+                cache, instance,
                 name='disk.device.read.requests',
                 type=sample.TYPE_CUMULATIVE,
                 unit='request',
@@ -182,27 +295,26 @@ class PerDeviceReadRequestsPollster(_Base):
 class ReadBytesPollster(_Base):
 
     @staticmethod
-    def _get_samples(instance, c_data):
-        return [util.make_sample_from_instance(
-            instance,
+    def _get_samples(cache, instance, c_data):
+        return [template.make_sample(
+            cache, instance,
             name='disk.read.bytes',
             type=sample.TYPE_CUMULATIVE,
             unit='B',
-            volume=c_data.r_bytes,
+            volume=c_data.total('read_bytes'),
             additional_metadata={
-                'device': c_data.per_disk_requests['read_bytes'].keys()},
+                'device': c_data.devices('read_bytes')},
         )]
 
 
 class PerDeviceReadBytesPollster(_Base):
 
     @staticmethod
-    def _get_samples(instance, c_data):
+    def _get_samples(cache, instance, c_data):
         samples = []
-        for disk, value in six.iteritems(c_data.per_disk_requests[
-                'read_bytes']):
-            samples.append(util.make_sample_from_instance(
-                instance,
+        for disk, value in c_data.values('read_bytes'):
+            samples.append(template.make_sample(
+                cache, instance,
                 name='disk.device.read.bytes',
                 type=sample.TYPE_CUMULATIVE,
                 unit='B',
@@ -215,27 +327,26 @@ class PerDeviceReadBytesPollster(_Base):
 class WriteRequestsPollster(_Base):
 
     @staticmethod
-    def _get_samples(instance, c_data):
-        return [util.make_sample_from_instance(
-            instance,
+    def _get_samples(cache, instance, c_data):
+        return [template.make_sample(
+            cache, instance,
             name='disk.write.requests',
             type=sample.TYPE_CUMULATIVE,
             unit='request',
-            volume=c_data.w_requests,
+            volume=c_data.total('write_requests'),
             additional_metadata={
-                'device': c_data.per_disk_requests['write_requests'].keys()},
+                'device': c_data.devices('write_requests')},
         )]
 
 
 class PerDeviceWriteRequestsPollster(_Base):
 
     @staticmethod
-    def _get_samples(instance, c_data):
+    def _get_samples(cache, instance, c_data):
         samples = []
-        for disk, value in six.iteritems(c_data.per_disk_requests[
-                'write_requests']):
-            samples.append(util.make_sample_from_instance(
-                instance,
+        for disk, value in c_data.values('write_requests'):
+            samples.append(template.make_sample(
+                cache, instance,
                 name='disk.device.write.requests',
                 type=sample.TYPE_CUMULATIVE,
                 unit='request',
@@ -248,27 +359,26 @@ class PerDeviceWriteRequestsPollster(_Base):
 class WriteBytesPollster(_Base):
 
     @staticmethod
-    def _get_samples(instance, c_data):
-        return [util.make_sample_from_instance(
-            instance,
+    def _get_samples(cache, instance, c_data):
+        return [template.make_sample(
+            cache, instance,
             name='disk.write.bytes',
             type=sample.TYPE_CUMULATIVE,
             unit='B',
-            volume=c_data.w_bytes,
+            volume=c_data.total('write_bytes'),
             additional_metadata={
-                'device': c_data.per_disk_requests['write_bytes'].keys()},
+                'device': c_data.devices('write_bytes')},
         )]
 
 
 class PerDeviceWriteBytesPollster(_Base):
 
     @staticmethod
-    def _get_samples(instance, c_data):
+    def _get_samples(cache, instance, c_data):
         samples = []
-        for disk, value in six.iteritems(c_data.per_disk_requests[
-                'write_bytes']):
-            samples.append(util.make_sample_from_instance(
-                instance,
+        for disk, value in c_data.values('write_bytes'):
+            samples.append(template.make_sample(
+                cache, instance,
                 name='disk.device.write.bytes',
                 type=sample.TYPE_CUMULATIVE,
                 unit='B',
@@ -278,103 +388,45 @@ class PerDeviceWriteBytesPollster(_Base):
         return samples
 
 
-@six.add_metaclass(abc.ABCMeta)
-class _DiskRatesPollsterBase(plugin.ComputePollster):
-
-    CACHE_KEY_DISK_RATE = 'diskio-rate'
-
-    def _populate_cache(self, inspector, cache, instance):
-        i_cache = cache.setdefault(self.CACHE_KEY_DISK_RATE, {})
-        if instance.id not in i_cache:
-            r_bytes_rate = 0
-            r_requests_rate = 0
-            w_bytes_rate = 0
-            w_requests_rate = 0
-            per_disk_r_bytes_rate = {}
-            per_disk_r_requests_rate = {}
-            per_disk_w_bytes_rate = {}
-            per_disk_w_requests_rate = {}
-            disk_rates = inspector.inspect_disk_rates(
-                instance, self._inspection_duration)
-            for disk, info in disk_rates:
-                r_bytes_rate += info.read_bytes_rate
-                r_requests_rate += info.read_requests_rate
-                w_bytes_rate += info.write_bytes_rate
-                w_requests_rate += info.write_requests_rate
-
-                per_disk_r_bytes_rate[disk.device] = info.read_bytes_rate
-                per_disk_r_requests_rate[disk.device] = info.read_requests_rate
-                per_disk_w_bytes_rate[disk.device] = info.write_bytes_rate
-                per_disk_w_requests_rate[disk.device] = (
-                    info.write_requests_rate)
-            per_disk_rate = {
-                'read_bytes_rate': per_disk_r_bytes_rate,
-                'read_requests_rate': per_disk_r_requests_rate,
-                'write_bytes_rate': per_disk_w_bytes_rate,
-                'write_requests_rate': per_disk_w_requests_rate,
-            }
-            i_cache[instance.id] = DiskRateData(
-                r_bytes_rate,
-                r_requests_rate,
-                w_bytes_rate,
-                w_requests_rate,
-                per_disk_rate
-            )
-        return i_cache[instance.id]
+class _DiskRatesPollsterBase(_Base):
 
-    @abc.abstractmethod
-    def _get_samples(self, instance, disk_rates_info):
-        """Return one or more Sample."""
+    DISK_DATA = 'rates'
 
-    def get_samples(self, manager, cache, resources):
-        self._inspection_duration = self._record_poll_time()
-        for instance in resources:
-            try:
-                disk_rates_info = self._populate_cache(
-                    manager.inspector,
-                    cache,
-                    instance,
-                )
-                for disk_rate in self._get_samples(instance, disk_rates_info):
-                    yield disk_rate
-            except virt_inspector.InstanceNotFoundException as err:
-                # Instance was deleted while getting samples. Ignore it.
-                LOG.debug(_('Exception while getting samples %s'), err)
-            except ceilometer.NotImplementedError:
-                # Selected inspector does not implement this pollster.
-                LOG.debug(_('%(inspector)s does not provide data for '
-                            ' %(pollster)s'),
-                          {'inspector': manager.inspector.__class__.__name__,
-                           'pollster': self.__class__.__name__})
-            except Exception as err:
-                instance_name = util.instance_name(instance)
-                LOG.exception(_('Ignoring instance %(name)s: %(error)s'),
-                              {'name': instance_name, 'error': err})
+    @staticmethod
+    def _get_total_samples(cache, instance, disk_rates_info, name, unit,
+                           column):
+        devices = disk_rates_info.devices(column)
+        if not devices:
+            # A rate needs two samples, the first poll has none, and a
+            # total of 0 would pass for an idle instance.
+            LOG.debug(_('No %(meter)s yet for instance %(id)s'),
+                      {'meter': name, 'id': instance.id})
+            return []
+        return [template.make_sample(
+            cache, instance,
+            name=name,
+            type=sample.TYPE_GAUGE,
+            unit=unit,
+            volume=disk_rates_info.total(column),
+            additional_metadata={'device': devices},
+        )]
 
 
 class ReadBytesRatePollster(_DiskRatesPollsterBase):
 
-    def _get_samples(self, instance, disk_rates_info):
-        return [util.make_sample_from_instance(
-            instance,
-            name='disk.read.bytes.rate',
-            type=sample.TYPE_GAUGE,
-            unit='B/s',
-            volume=disk_rates_info.read_bytes_rate,
-            additional_metadata={
-                'device': disk_rates_info.per_disk_rate[
-                    'read_bytes_rate'].keys()},
-        )]
+    def _get_samples(self, cache, instance, disk_rates_info):
+        return self._get_total_samples(
+            cache, instance, disk_rates_info,
+            'disk.read.bytes.rate', 'B/s', 'read_bytes_rate')
 
 
 class PerDeviceReadBytesRatePollster(_DiskRatesPollsterBase):
 
-    def _get_samples(self, instance, disk_rates_info):
+    def _get_samples(self, cache, instance, disk_rates_info):
         samples = []
-        for disk, value in six.iteritems(disk_rates_info.per_disk_rate[
-                'read_bytes_rate']):
-            samples.append(util.make_sample_from_instance(
-                instance,
+        for disk, value in disk_rates_info.values('read_bytes_rate'):
+            samples.append(template.make_sample(
+                cache, instance,
                 name='disk.device.read.bytes.rate',
                 type=sample.TYPE_GAUGE,
                 unit='B/s',
@@ -386,27 +438,19 @@ class PerDeviceReadBytesRatePollster(_DiskRatesPollsterBase):
 
 class ReadRequestsRatePollster(_DiskRatesPollsterBase):
 
-    def _get_samples(self, instance, disk_rates_info):
-        return [util.make_sample_from_instance(
-            instance,
-            name='disk.read.requests.rate',
-            type=sample.TYPE_GAUGE,
-            unit='requests/s',
-            volume=disk_rates_info.read_requests_rate,
-            additional_metadata={
-                'device': disk_rates_info.per_disk_rate[
-                    'read_requests_rate'].keys()},
-        )]
+    def _get_samples(self, cache, instance, disk_rates_info):
+        return self._get_total_samples(
+            cache, instance, disk_rates_info,
+            'disk.read.requests.rate', 'requests/s', 'read_requests_rate')
 
 
 class PerDeviceReadRequestsRatePollster(_DiskRatesPollsterBase):
 
-    def _get_samples(self, instance, disk_rates_info):
+    def _get_samples(self, cache, instance, disk_rates_info):
         samples = []
-        for disk, value in six.iteritems(disk_rates_info.per_disk_rate[
-                'read_requests_rate']):
-            samples.append(util.make_sample_from_instance(
-                instance,
+        for disk, value in disk_rates_info.values('read_requests_rate'):
+            samples.append(template.make_sample(
+                cache, instance,
                 name='disk.device.read.requests.rate',
                 type=sample.TYPE_GAUGE,
                 unit='requests/s',
@@ -418,27 +462,19 @@ class PerDeviceReadRequestsRatePollster(_DiskRatesPollsterBase):
 
 class WriteBytesRatePollster(_DiskRatesPollsterBase):
 
-    def _get_samples(self, instance, disk_rates_info):
-        return [util.make_sample_from_instance(
-            instance,
-            name='disk.write.bytes.rate',
-            type=sample.TYPE_GAUGE,
-            unit='B/s',
-            volume=disk_rates_info.write_bytes_rate,
-            additional_metadata={
-                'device': disk_rates_info.per_disk_rate[
-                    'write_bytes_rate'].keys()},
-        )]
+    def _get_samples(self, cache, instance, disk_rates_info):
+        return self._get_total_samples(
+            cache, instance, disk_rates_info,
+            'disk.write.bytes.rate', 'B/s', 'write_bytes_rate')
 
 
 class PerDeviceWriteBytesRatePollster(_DiskRatesPollsterBase):
 
-    def _get_samples(self, instance, disk_rates_info):
+    def _get_samples(self, cache, instance, disk_rates_info):
         samples = []
-        for disk, value in six.iteritems(disk_rates_info.per_disk_rate[
-                'write_bytes_rate']):
-            samples.append(util.make_sample_from_instance(
-                instance,
+        for disk, value in disk_rates_info.values('write_bytes_rate'):
+            samples.append(template.make_sample(
+                cache, instance,
                 name='disk.device.write.bytes.rate',
                 type=sample.TYPE_GAUGE,
                 unit='B/s',
@@ -450,27 +486,19 @@ class PerDeviceWriteBytesRatePollster(_DiskRatesPollsterBase):
 
 class WriteRequestsRatePollster(_DiskRatesPollsterBase):
 
-    def _get_samples(self, instance, disk_rates_info):
-        return [util.make_sample_from_instance(
-            instance,
-            name='disk.write.requests.rate',
-            type=sample.TYPE_GAUGE,
-            unit='requests/s',
-            volume=disk_rates_info.write_requests_rate,
-            additional_metadata={
-                'device': disk_rates_info.per_disk_rate[
-                    'write_requests_rate'].keys()},
-        )]
+    def _get_samples(self, cache, instance, disk_rates_info):
+        return self._get_total_samples(
+            cache, instance, disk_rates_info,
+            'disk.write.requests.rate', 'requests/s', 'write_requests_rate')
 
 
 class PerDeviceWriteRequestsRatePollster(_DiskRatesPollsterBase):
 
-    def _get_samples(self, instance, disk_rates_info):
+    def _get_samples(self, cache, instance, disk_rates_info):
         samples = []
-        for disk, value in six.iteritems(disk_rates_info.per_disk_rate[
-                'write_requests_rate']):
-            samples.append(util.make_sample_from_instance(
-                instance,
+        for disk, value in disk_rates_info.values('write_requests_rate'):
+            samples.append(template.make_sample(
+                cache, instance,
                 name='disk.device.write.requests.rate',
                 type=sample.TYPE_GAUGE,
                 unit='requests/s',
@@ -481,117 +509,46 @@ class PerDeviceWriteRequestsRatePollster(_DiskRatesPollsterBase):
 
 ###################################Just added##############
 
-class _DiskInfoPollsterBase(plugin.ComputePollster):
-
-    CACHE_KEY_DISK_INFO = 'diskinfo'
-
-    def _populate_cache(self, inspector, cache, instance):
-        i_cache = cache.setdefault(self.CACHE_KEY_DISK_INFO, {})
-        if instance.id not in i_cache:
-            instance_name = util.instance_name(instance)
-            all_capacity = 0
-            all_allocation = 0
-            all_physical = 0
-            per_disk_capacity = {}
-            per_disk_allocation = {}
-            per_disk_physical = {}
-            disk_info = inspector.inspect_disk_info(instance_name)
-            for disk, info in disk_info:
-                all_capacity += info.capacity
-                all_allocation += info.allocation
-                all_physical += info.physical
-
-                per_disk_capacity[disk.device] = info.capacity
-                per_disk_allocation[disk.device] = info.allocation
-                per_disk_physical[disk.device] = info.physical
-            per_disk_info = {
-                'capacity': per_disk_capacity,
-                'allocation': per_disk_allocation,
-                'physical': per_disk_physical,
-            }
-            i_cache[instance.id] = DiskInfoData(
-                all_capacity,
-                all_allocation,
-                all_physical,
-                per_disk_info
-            )
-        return i_cache[instance.id]
+class _DiskInfoPollsterBase(_Base):
 
-    @abc.abstractmethod
-    def _get_samples(self, instance, disk_info):
-        """Return one or more Sample."""
-
-    def get_samples(self, manager, cache, resources):
-        for instance in resources:
-            try:
-                disk_size_info = self._populate_cache(
-                    manager.inspector,
-                    cache,
-                    instance,
-                )
-                for disk_info in self._get_samples(instance, disk_size_info):
-                    yield disk_info
-            except virt_inspector.InstanceNotFoundException as err:
-                # Instance was deleted while getting samples. Ignore it.
-                LOG.debug(_('Exception while getting samples %s'), err)
-            #except virt_inspector.InstanceShutOffException as e:
-            #    LOG.warn(_LW('Instance %(instance_id)s was shut off while '
-            #                 'getting samples of %(pollster)s: %(exc)s'),
-            #             {'instance_id': instance.id,
-            #              'pollster': self.__class__.__name__, 'exc': e})
-            except ceilometer.NotImplementedError:
-                # Selected inspector does not implement this pollster.
-                LOG.debug(_('%(inspector)s does not provide data for '
-                            ' %(pollster)s'), (
-                          {'inspector': self.inspector.__class__.__name__,
-                           'pollster': self.__class__.__name__}))
-            except Exception as err:
-                instance_name = util.instance_name(instance)
-                LOG.exception(_('Ignoring instance %(name)s '
-                                '(%(instance_id)s) : %(error)s') % (
-                              {'name': instance_name,
-                               'instance_id': instance.id,
-                               'error': err}))
+    DISK_DATA = 'info'
 
 
 class CapacityPollster(_DiskInfoPollsterBase):
 
-    def _get_samples(self, instance, disk_info):
-        return [util.make_sample_from_instance(
-            instance,
+    def _get_samples(self, cache, instance, disk_info):
+        return [template.make_sample(
+            cache, instance,
             name='disk.capacity',
             type=sample.TYPE_GAUGE,
             unit='B',
-            volume=disk_info.capacity,
+            volume=disk_info.total('capacity'),
             additional_metadata={
-                'device': disk_info.per_disk_info[
-                    'capacity'].keys()},
+                'device': disk_info.devices('capacity')},
         )]
 
 
 class AllocationPollster(_DiskInfoPollsterBase):
 
-    def _get_samples(self, instance, disk_info):
-        return [util.make_sample_from_instance(
-            instance,
+    def _get_samples(self, cache, instance, disk_info):
+        return [template.make_sample(
+            cache, instance,
             name='disk.allocation',
             type=sample.TYPE_GAUGE,
             unit='B',
-            volume=disk_info.allocation,
+            volume=disk_info.total('allocation'),
             additional_metadata={
-                'device': disk_info.per_disk_info[
-                    'allocation'].keys()},
+                'device': disk_info.devices('allocation')},
         )]
 
 
 class PerDeviceAllocationPollster(_DiskInfoPollsterBase):
 
-    def _get_samples(self, instance, disk_info):
+    def _get_samples(self, cache, instance, disk_info):
         samples = []
-        for disk, value in six.iteritems(disk_info.per_disk_info[
-                'allocation']):
-            samples.append(util.make_sample_from_instance(
-                instance,
+        for disk, value in disk_info.values('allocation'):
+            samples.append(template.make_sample(
+                cache, instance,
                 name='disk.device.allocation',
                 type=sample.TYPE_GAUGE,
                 unit='B',
@@ -602,12 +559,11 @@ class PerDeviceAllocationPollster(_DiskInfoPollsterBase):
 
 class PerDeviceCapacityPollster(_DiskInfoPollsterBase):
 
-    def _get_samples(self, instance, disk_info):
+    def _get_samples(self, cache, instance, disk_info):
         samples = []
-        for disk, value in six.iteritems(disk_info.per_disk_info[
-                'capacity']):
-            samples.append(util.make_sample_from_instance(
-                instance,
+        for disk, value in disk_info.values('capacity'):
+            samples.append(template.make_sample(
+                cache, instance,
                 name='disk.device.capacity',
                 type=sample.TYPE_GAUGE,
                 unit='B',
@@ -618,12 +574,11 @@ class PerDeviceCapacityPollster(_DiskInfoPollsterBase):
 
 class PerDevicePhysicalPollster(_DiskInfoPollsterBase):
 
-    def _get_samples(self, instance, disk_info):
+    def _get_samples(self, cache, instance, disk_info):
         samples = []
-        for disk, value in six.iteritems(disk_info.per_disk_info[
-                'physical']):
-            samples.append(util.make_sample_from_instance(
-                instance,
+        for disk, value in disk_info.values('physical'):
+            samples.append(template.make_sample(
+                cache, instance,
                 name='disk.device.usage',
                 type=sample.TYPE_GAUGE,
                 unit='B',
@@ -635,14 +590,82 @@ class PerDevicePhysicalPollster(_DiskInfoPollsterBase):
 
 class PhysicalPollster(_DiskInfoPollsterBase):
 
-    def _get_samples(self, instance, disk_info):
-        return [util.make_sample_from_instance(
-            instance,
+    def _get_samples(self, cache, instance, disk_info):
+        return [template.make_sample(
+            cache, instance,
             name='disk.usage',
             type=sample.TYPE_GAUGE,
             unit='B',
-            volume=disk_info.physical,
+            volume=disk_info.total('physical'),
             additional_metadata={
-                'device': disk_info.per_disk_info[
-                    'physical'].keys()},
+                'device': disk_info.devices('physical')},
         )]
+
+
+def _host_totals(disk_data, columns):
+    """Sum the columns over every device of every instance.
+
+    Only the columns reported by at least one device are returned. The
+    sums are vectorised when NumPy is available.
+    """
+    rows = [[getattr(record, column) for column in columns]
+            for c_data in disk_data for record in c_data.records]
+    if not rows:
+        return {}
+    if numpy is not None:
+        # Unknown values (None) become NaN and are left out of the sums.
+        matrix = numpy.array(rows, dtype=float)
+        reported = ~numpy.isnan(matrix).all(axis=0)
+        sums = numpy.nansum(matrix, axis=0)
+        return dict((column, float(sums[i]))
+                    for i, column in enumerate(columns) if reported[i])
+    totals = {}
+    for row in rows:
+        for column, value in zip(columns, row):
+            if value is not None:
+                totals[column] = totals.get(column, 0) + value
+    return totals
+
+
+class HostDiskPollster(_Base):
+    """Disk activity of all the instances of the host together.
+
+    The counters are reported as gauges since they go down when instances
+    leave the host.
+    """
+
+    METERS = [
+        ('read.bytes', 'B', 'read_bytes'),
+        ('read.requests', 'request', 'read_requests'),
+        ('write.bytes', 'B', 'write_bytes'),
+        ('write.requests', 'request', 'write_requests'),
+        ('read.bytes.rate', 'B/s', 'read_bytes_rate'),
+        ('read.requests.rate', 'requests/s', 'read_requests_rate'),
+        ('write.bytes.rate', 'B/s', 'write_bytes_rate'),
+        ('write.requests.rate', 'requests/s', 'write_requests_rate'),
+    ]
+
+    @staticmethod
+    def _get_samples(cache, instance, c_data):
+        # Handed over to get_samples to be summed with the other instances.
+        return [c_data]
+
+    def get_samples(self, manager, cache, resources):
+        disk_data = list(self._iter_samples(manager, cache, resources))
+        totals = _host_totals(disk_data,
+                              [column for n, u, column in self.METERS])
+        host = cfg.CONF.host
+        for name, unit, column in self.METERS:
+            if column not in totals:
+                continue
+            yield sample.Sample(
+                name='compute.node.disk.%s' % name,
+                type=sample.TYPE_GAUGE,
+                unit=unit,
+                volume=totals[column],
+                user_id=None,
+                project_id=None,
+                resource_id="%s_%s" % (host, host),
+                timestamp=timeutils.isotime(),
+                resource_metadata={'instances': len(disk_data)}
+            )
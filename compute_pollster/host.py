@@ -17,48 +17,234 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
+import time
+
+import eventlet
 from ceilometer.openstack.common import log
 from ceilometer.compute import pollsters
 from ceilometer.i18n import _, _LW
 from ceilometer import sample
 from oslo.utils import timeutils
+from oslo.utils import units
 from oslo.config import cfg
+from keystoneclient.auth.identity import v2
+from keystoneclient import session
 from novaclient import client
 
 LOG = log.getLogger(__name__)
 
+OPTS = [
+    cfg.BoolOpt('host_pollster_local',
+                default=False,
+                help='Collect the compute.node.* meters on the host itself, '
+                     'without calling nova. The totals come from libvirt '
+                     'and from the file system of host_instances_path, the '
+                     '"now" meters are what the host actually uses and the '
+                     '"max" meters what all its instances are given.'),
+    cfg.StrOpt('host_instances_path',
+               default='/var/lib/nova/instances',
+               help='Directory holding the instance disks, whose file system '
+                    'gives the disk meters of the local host collection.'),
+    cfg.IntOpt('host_pollster_nova_check_interval',
+               default=0,
+               help='Number of seconds between two comparisons of the host '
+                    'totals collected locally with those of nova, a warning '
+                    'being logged when they differ. 0 disables them.'),
+    cfg.IntOpt('host_pollster_nova_deadline',
+               default=0,
+               help='Number of seconds a polling cycle waits for the host '
+                    'values of nova, which are requested in the background. '
+                    'Past it the last values received are emitted, flagged '
+                    'as stale in their metadata. 0 waits for nova for as '
+                    'long as the request takes.'),
+]
+
+cfg.CONF.register_opts(OPTS)
+
+
+class _CountingPassword(v2.Password):
+    """Password authentication counting the tokens actually requested."""
+
+    def __init__(self, *args, **kwargs):
+        super(_CountingPassword, self).__init__(*args, **kwargs)
+        self.auth_count = 0
+
+    def get_auth_ref(self, session, **kwargs):
+        self.auth_count += 1
+        return super(_CountingPassword, self).get_auth_ref(session, **kwargs)
+
 
 class HostPollster(pollsters.BaseComputePollster):
 
+    # Relative difference between the local and nova totals tolerated by
+    # the nova check.
+    NOVA_CHECK_TOLERANCE = 0.1
+
+    def __init__(self):
+        super(HostPollster, self).__init__()
+        self._nova = None
+        self._auth = None
+        self._polls = 0
+        self._nova_check_at = 0
+        self._nova_call = None
+        self._nova_cache = None
+
+    def _get_nova(self):
+        # The session keeps its token across cycles, getting a new one
+        # shortly before it expires or when nova answers 401.
+        if self._nova is None:
+            creds = cfg.CONF.service_credentials
+            self._auth = _CountingPassword(
+                auth_url=creds.os_auth_url,
+                username=creds.os_username,
+                password=creds.os_password,
+                tenant_name=creds.os_tenant_name)
+            verify = False if creds.insecure else (creds.os_cacert or True)
+            self._nova = client.Client(
+                version=2,
+                session=session.Session(auth=self._auth, verify=verify),
+                region_name=creds.os_region_name)
+        return self._nova
+
+    @property
+    def auth_round_trips_avoided(self):
+        """Keystone authentications saved compared to one per cycle."""
+        auth_count = self._auth.auth_count if self._auth is not None else 0
+        return self._polls - auth_count
+
+    def _get_nova_values(self, host):
+        nt = self._get_nova()
+        self._polls += 1
+        info = nt.hosts.get(host)
+        LOG.debug(_('%d keystone authentications avoided so far'),
+                  self.auth_round_trips_avoided)
+        values = []
+        if len(info) >= 3:
+            # total
+            values.append({'name': 'ram.tot', 'unit': 'MB', 'value': (info[0].memory_mb if info[0].memory_mb else 0)})
+            values.append({'name': 'disk.tot', 'unit': 'GB', 'value': (info[0].disk_gb if info[0].disk_gb else 0)})
+            values.append({'name': 'cpu.tot', 'unit': 'cpu', 'value': (info[0].cpu if info[0].cpu else 0)})
+            # now
+            values.append({'name': 'ram.now', 'unit': 'MB', 'value': (info[1].memory_mb if info[1].memory_mb else 0)})
+            values.append({'name': 'disk.now', 'unit': 'GB', 'value': (info[1].disk_gb if info[1].disk_gb else 0)})
+            values.append({'name': 'cpu.now', 'unit': 'cpu', 'value': (info[1].cpu if info[1].cpu else 0)})
+            # max
+            values.append({'name': 'ram.max', 'unit': 'MB', 'value': (info[2].memory_mb if info[2].memory_mb else 0)})
+            values.append({'name': 'disk.max', 'unit': 'GB', 'value': (info[2].disk_gb if info[2].disk_gb else 0)})
+            values.append({'name': 'cpu.max', 'unit': 'cpu', 'value': (info[2].cpu if info[2].cpu else 0)})
+        return values
+
+    def _fetch_nova_values(self, host):
+        """Get the nova values of host, keeping them for later cycles."""
+        try:
+            values = self._get_nova_values(host)
+            self._nova_cache = (values, timeutils.isotime())
+            return values
+        except Exception as err:
+            # Nobody may be waiting for the answer anymore.
+            LOG.warn(_LW('Could not get info for host %(host)s from nova: '
+                         '%(e)s'), {'host': host, 'e': err})
+        finally:
+            self._nova_call = None
+
+    def _get_nova_values_within_deadline(self, host):
+        """Nova values of host and the time they were received at.
+
+        The time is None when nova answered within the deadline, otherwise
+        the values are the last ones received, if any.
+        """
+        deadline = cfg.CONF.host_pollster_nova_deadline
+        if deadline <= 0:
+            return self._get_nova_values(host), None
+        # A request still running from a previous cycle is waited for
+        # rather than sent again.
+        if self._nova_call is None:
+            self._nova_call = eventlet.spawn(self._fetch_nova_values, host)
+        call = self._nova_call
+        values = None
+        timeout = eventlet.Timeout(deadline)
+        try:
+            values = call.wait()
+        except eventlet.Timeout as t:
+            if t is not timeout:
+                raise
+            LOG.warn(_LW('nova did not answer for host %(host)s within '
+                         '%(deadline)s seconds'),
+                     {'host': host, 'deadline': deadline})
+        finally:
+            timeout.cancel()
+        if values is not None:
+            return values, None
+        if self._nova_cache is None:
+            return [], None
+        return self._nova_cache
+
     @staticmethod
-    def get_samples(manager, cache, resources):
-        nt = client.Client(
-            version=2,
-            username=cfg.CONF.service_credentials.os_username,
-            api_key=cfg.CONF.service_credentials.os_password,
-            project_id=cfg.CONF.service_credentials.os_tenant_name,
-            auth_url=cfg.CONF.service_credentials.os_auth_url,
-            region_name=cfg.CONF.service_credentials.os_region_name)
+    def _get_local_values(manager):
+        capacity = manager.inspector.inspect_host_capacity()
+        disk = os.statvfs(cfg.CONF.host_instances_path)
+        disk_total = disk.f_blocks * disk.f_frsize / units.Gi
+        disk_used = (disk.f_blocks - disk.f_bfree) * disk.f_frsize / units.Gi
+        return [
+            # total
+            {'name': 'ram.tot', 'unit': 'MB', 'value': capacity.memory_total},
+            {'name': 'disk.tot', 'unit': 'GB', 'value': disk_total},
+            {'name': 'cpu.tot', 'unit': 'cpu', 'value': capacity.vcpus_total},
+            # now
+            {'name': 'ram.now', 'unit': 'MB',
+             'value': capacity.memory_total - capacity.memory_free},
+            {'name': 'disk.now', 'unit': 'GB', 'value': disk_used},
+            {'name': 'cpu.now', 'unit': 'cpu', 'value': capacity.vcpus_used},
+            # max
+            {'name': 'ram.max', 'unit': 'MB',
+             'value': capacity.memory_allocated},
+            {'name': 'disk.max', 'unit': 'GB',
+             'value': capacity.disk_allocated},
+            {'name': 'cpu.max', 'unit': 'cpu',
+             'value': capacity.vcpus_allocated},
+        ]
+
+    def _check_with_nova(self, host, values):
+        """Compare the local totals with nova's, on a slow cadence."""
+        interval = cfg.CONF.host_pollster_nova_check_interval
+        now = time.time()
+        if interval <= 0 or now < self._nova_check_at:
+            return
+        self._nova_check_at = now + interval
+        try:
+            nova_values = dict((item['name'], item['value'])
+                               for item in self._get_nova_values(host))
+        except Exception as err:
+            LOG.warn(_LW('Could not check the capacity of host %(host)s '
+                         'with nova: %(e)s'), {'host': host, 'e': err})
+            return
+        for item in values:
+            if not item['name'].endswith('.tot'):
+                continue
+            expected = nova_values.get(item['name'])
+            if (expected and abs(item['value'] - expected) >
+                    self.NOVA_CHECK_TOLERANCE * expected):
+                LOG.warn(_LW('compute.node.%(name)s of host %(host)s is '
+                             '%(value)s locally but %(expected)s in nova'),
+                         {'name': item['name'], 'host': host,
+                          'value': item['value'], 'expected': expected})
 
+    def get_samples(self, manager, cache, resources):
         host = cfg.CONF.host
         nodename = cfg.CONF.host
         LOG.debug(_('checking host %s'), host)
         try:
-            info = nt.hosts.get(host)
-            values = []
-            if len(info) >= 3:
-                # total
-                values.append({'name': 'ram.tot', 'unit': 'MB', 'value': (info[0].memory_mb if info[0].memory_mb else 0)})
-                values.append({'name': 'disk.tot', 'unit': 'GB', 'value': (info[0].disk_gb if info[0].disk_gb else 0)})
-                values.append({'name': 'cpu.tot', 'unit': 'cpu', 'value': (info[0].cpu if info[0].cpu else 0)})
-                # now
-                values.append({'name': 'ram.now', 'unit': 'MB', 'value': (info[1].memory_mb if info[1].memory_mb else 0)})
-                values.append({'name': 'disk.now', 'unit': 'GB', 'value': (info[1].disk_gb if info[1].disk_gb else 0)})
-                values.append({'name': 'cpu.now', 'unit': 'cpu', 'value': (info[1].cpu if info[1].cpu else 0)})
-                # max
-                values.append({'name': 'ram.max', 'unit': 'MB', 'value': (info[2].memory_mb if info[2].memory_mb else 0)})
-                values.append({'name': 'disk.max', 'unit': 'GB', 'value': (info[2].disk_gb if info[2].disk_gb else 0)})
-                values.append({'name': 'cpu.max', 'unit': 'cpu', 'value': (info[2].cpu if info[2].cpu else 0)})
+            received_at = None
+            if cfg.CONF.host_pollster_local:
+                values = self._get_local_values(manager)
+                self._check_with_nova(host, values)
+            else:
+                values, received_at = (
+                    self._get_nova_values_within_deadline(host))
+            metadata = {}
+            if received_at is not None:
+                metadata = {'stale': True, 'received_at': received_at}
 
             for item in values:
                 yield sample.Sample(
@@ -70,7 +256,7 @@ class HostPollster(pollsters.BaseComputePollster):
                     project_id=None,
                     resource_id="%s_%s" % (host, nodename),
                     timestamp=timeutils.isotime(),
-                    resource_metadata={}
+                    resource_metadata=metadata
                 )
 
         except Exception as err:
@@ -16,9 +16,16 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import functools
+
+from oslo.config import cfg
+from oslo.utils import timeutils
+
 import ceilometer
 from ceilometer.compute import plugin
-from ceilometer.compute.pollsters import util
+from ceilometer.compute.pollsters import snapshot
+from ceilometer.compute.pollsters import template
+from ceilometer.compute.pollsters import workers
 from ceilometer.compute.virt import inspector as virt_inspector
 from ceilometer.openstack.common.gettextutils import _
 from ceilometer.openstack.common import log
@@ -26,70 +33,207 @@ from ceilometer import sample
 
 LOG = log.getLogger(__name__)
 
+# Fields read with the same memoryStats call, inspected together by
+# whichever memory pollster needs an instance first.
+MEMORY_FIELDS = ['memory_usage', 'memory_resident', 'memory_stats']
+
+
 class MemoryUsagePollster(plugin.ComputePollster):
 
     def get_samples(self, manager, cache, resources):
         self._inspection_duration = self._record_poll_time()
-        for instance in resources:
-            LOG.debug(_('Checking memory usage for instance %s'), instance.id)
-            try:
-                instance_name = util.instance_name(instance)
-                memory_info = manager.inspector.inspect_memory_usage( instance_name, self._inspection_duration)
-                if (memory_info):
-                    usg=memory_info.usage
-                else:
-                    usg=0;
-                # Workaround https://bugs.launchpad.net/fuel/+bug/1379794
-                LOG.debug(_("MEMORY USAGE: %(instance)s %(usage)f"),
-                          ({'instance': getattr(instance, 'id'),
-                            'usage': usg}))
-                yield util.make_sample_from_instance(
-                    instance,
-                    name='memory.usage',
-                    type=sample.TYPE_GAUGE,
-                    unit='MB',
-                    volume=usg,
-                )
-            except virt_inspector.InstanceNotFoundException as err:
-                # Instance was deleted while getting samples. Ignore it.
-                LOG.debug(_('Exception while getting samples %s'), err)
-            except ceilometer.NotImplementedError:
-                # Selected inspector does not implement this pollster.
-                LOG.debug(_('Obtaining Memory Usage is not implemented for %s'
-                            ), manager.inspector.__class__.__name__)
-            except Exception as err:
-                LOG.exception(_('Could not get Memory Usage for '
-                                '%(id)s: %(e)s'), {'id': instance.id,
-                                                   'e': err})
+        return workers.iter_samples(
+            functools.partial(self._get_instance_samples, manager, cache),
+            resources)
+
+    def _get_instance_samples(self, manager, cache, instance):
+        LOG.debug(_('Checking memory usage for instance %s'), instance.id)
+        try:
+            memory_info = snapshot.get_snapshot(
+                manager, cache, instance, MEMORY_FIELDS,
+                self._inspection_duration).memory_usage
+            if memory_info is None:
+                # Reporting 0 would pass for an idle instance.
+                LOG.debug(_('No balloon stats for instance %s, skipping '
+                            'its memory usage'), instance.id)
+                return
+            usg = memory_info.usage
+            # Workaround https://bugs.launchpad.net/fuel/+bug/1379794
+            LOG.debug(_("MEMORY USAGE: %(instance)s %(usage)f"),
+                      ({'instance': getattr(instance, 'id'),
+                        'usage': usg}))
+            yield template.make_sample(
+                cache, instance,
+                name='memory.usage',
+                type=sample.TYPE_GAUGE,
+                unit='MB',
+                volume=usg,
+            )
+        except virt_inspector.InstanceNotFoundException as err:
+            # Instance was deleted while getting samples. Ignore it.
+            LOG.debug(_('Exception while getting samples %s'), err)
+        except virt_inspector.HypervisorUnavailableException as err:
+            # The inspector logged the failed connection attempt.
+            LOG.debug(_('Hypervisor unavailable: %s'), err)
+        except ceilometer.NotImplementedError:
+            # Selected inspector does not implement this pollster.
+            LOG.debug(_('Obtaining Memory Usage is not implemented for %s'
+                        ), manager.inspector.__class__.__name__)
+        except Exception as err:
+            LOG.exception(_('Could not get Memory Usage for '
+                            '%(id)s: %(e)s'), {'id': instance.id,
+                                               'e': err})
 
 class MemoryResidentPollster(plugin.ComputePollster):
     def get_samples(self, manager, cache, resources):
         self._inspection_duration = self._record_poll_time()
-        for instance in resources:
-            LOG.debug('Checking resident memory for instance %s',
-                      instance.id)
-            instance_name = util.instance_name(instance)
-            try:
-                memory_info = manager.inspector.inspect_memory_resident(
-                    instance_name, self._inspection_duration)
-                LOG.debug("RESIDENT MEMORY: %(instance)s %(resident)f",
-                          {'instance': instance,
-                           'resident': memory_info.resident})
-                yield util.make_sample_from_instance(
-                    instance,
-                    name='memory.resident',
-                    type=sample.TYPE_GAUGE,
-                    unit='MB',
-                    volume=memory_info.resident,
-                )
-            except virt_inspector.InstanceNotFoundException as err:
-                # Instance was deleted while getting samples. Ignore it.
-                LOG.debug('Exception while getting samples %s', err)
-            except ceilometer.NotImplementedError:
-                # Selected inspector does not implement this pollster.
-                LOG.debug('Obtaining Resident Memory is not implemented'
-                          ' for %s', self.inspector.__class__.__name__)
-            except Exception as err:
-                LOG.exception(_('Could not get Resident Memory Usage for '
-                                  '%(id)s: %(e)s'), {'id': instance.id,
-                                                     'e': err})
+        return workers.iter_samples(
+            functools.partial(self._get_instance_samples, manager, cache),
+            resources)
+
+    def _get_instance_samples(self, manager, cache, instance):
+        LOG.debug('Checking resident memory for instance %s',
+                  instance.id)
+        try:
+            memory_info = snapshot.get_snapshot(
+                manager, cache, instance, MEMORY_FIELDS,
+                self._inspection_duration).memory_resident
+            if memory_info is None:
+                raise ceilometer.NotImplementedError
+            LOG.debug("RESIDENT MEMORY: %(instance)s %(resident)f",
+                      {'instance': instance,
+                       'resident': memory_info.resident})
+            yield template.make_sample(
+                cache, instance,
+                name='memory.resident',
+                type=sample.TYPE_GAUGE,
+                unit='MB',
+                volume=memory_info.resident,
+            )
+        except virt_inspector.InstanceNotFoundException as err:
+            # Instance was deleted while getting samples. Ignore it.
+            LOG.debug('Exception while getting samples %s', err)
+        except virt_inspector.HypervisorUnavailableException as err:
+            # The inspector logged the failed connection attempt.
+            LOG.debug(_('Hypervisor unavailable: %s'), err)
+        except ceilometer.NotImplementedError:
+            # Selected inspector does not implement this pollster.
+            LOG.debug('Obtaining Resident Memory is not implemented'
+                      ' for %s', manager.inspector.__class__.__name__)
+        except Exception as err:
+            LOG.exception(_('Could not get Resident Memory Usage for '
+                              '%(id)s: %(e)s'), {'id': instance.id,
+                                                 'e': err})
+
+
+class _MemoryStatsPollsterBase(plugin.ComputePollster):
+    """Base of the pollsters reporting one of the balloon statistics.
+
+    All of them share the memory_stats field of the instance snapshot,
+    read with a single memoryStats call.
+    """
+
+    NAME = None
+    TYPE = None
+    UNIT = None
+    FIELD = None
+
+    def get_samples(self, manager, cache, resources):
+        self._inspection_duration = self._record_poll_time()
+        return workers.iter_samples(
+            functools.partial(self._get_instance_samples, manager, cache),
+            resources)
+
+    def _get_instance_samples(self, manager, cache, instance):
+        LOG.debug(_('Checking %(meter)s for instance %(id)s'),
+                  {'meter': self.NAME, 'id': instance.id})
+        try:
+            memory_stats = snapshot.get_snapshot(
+                manager, cache, instance, MEMORY_FIELDS,
+                self._inspection_duration).memory_stats
+            if memory_stats is None:
+                raise ceilometer.NotImplementedError
+            value = getattr(memory_stats, self.FIELD)
+            if value is None:
+                # The guest balloon driver does not report it.
+                LOG.debug(_('No %(meter)s for instance %(id)s'),
+                          {'meter': self.NAME, 'id': instance.id})
+                return
+            yield template.make_sample(
+                cache, instance,
+                name=self.NAME,
+                type=self.TYPE,
+                unit=self.UNIT,
+                volume=value,
+            )
+        except virt_inspector.InstanceNotFoundException as err:
+            # Instance was deleted while getting samples. Ignore it.
+            LOG.debug(_('Exception while getting samples %s'), err)
+        except virt_inspector.HypervisorUnavailableException as err:
+            # The inspector logged the failed connection attempt.
+            LOG.debug(_('Hypervisor unavailable: %s'), err)
+        except ceilometer.NotImplementedError:
+            # Selected inspector does not implement this pollster.
+            LOG.debug(_('Obtaining %(meter)s is not implemented for '
+                        '%(inspector)s'),
+                      {'meter': self.NAME,
+                       'inspector': manager.inspector.__class__.__name__})
+        except Exception as err:
+            LOG.exception(_('Could not get %(meter)s for %(id)s: %(e)s'),
+                          {'meter': self.NAME, 'id': instance.id, 'e': err})
+
+
+class MemorySwapInPollster(_MemoryStatsPollsterBase):
+
+    NAME = 'memory.swap.in'
+    TYPE = sample.TYPE_CUMULATIVE
+    UNIT = 'MB'
+    FIELD = 'swap_in'
+
+
+class MemorySwapOutPollster(_MemoryStatsPollsterBase):
+
+    NAME = 'memory.swap.out'
+    TYPE = sample.TYPE_CUMULATIVE
+    UNIT = 'MB'
+    FIELD = 'swap_out'
+
+
+class MemoryAvailablePollster(_MemoryStatsPollsterBase):
+
+    NAME = 'memory.available'
+    TYPE = sample.TYPE_GAUGE
+    UNIT = 'MB'
+    FIELD = 'available'
+
+
+class BalloonMissingPollster(plugin.ComputePollster):
+    """Number of instances of the host lacking balloon statistics.
+
+    The count comes from the memory usage inspections of the previous
+    cycle, or of this one when they ran first.
+    """
+
+    def get_samples(self, manager, cache, resources):
+        host = cfg.CONF.host
+        try:
+            count = manager.inspector.inspect_domains_without_balloon_stats()
+            yield sample.Sample(
+                name='compute.node.memory.no_balloon',
+                type=sample.TYPE_GAUGE,
+                unit='instance',
+                volume=count,
+                user_id=None,
+                project_id=None,
+                resource_id="%s_%s" % (host, host),
+                timestamp=timeutils.isotime(),
+                resource_metadata={}
+            )
+        except ceilometer.NotImplementedError:
+            # Selected inspector does not implement this pollster.
+            LOG.debug(_('Counting instances without balloon stats is not '
+                        'implemented for %s'),
+                      manager.inspector.__class__.__name__)
+        except Exception as err:
+            LOG.exception(_('Could not count instances without balloon '
+                            'stats: %s'), err)
@@ -0,0 +1,64 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Instance snapshots shared by the compute pollsters of a polling cycle."""
+
+from oslo.config import cfg
+
+from ceilometer.compute.pollsters import util
+from ceilometer.compute.virt import inspector as virt_inspector
+
+OPTS = [
+    cfg.ListOpt('compute_snapshot_fields',
+                default=[],
+                help='Fields inspected along with those asked for the first '
+                     'time a compute pollster needs an instance in a polling '
+                     'cycle. Listing the fields of all the enabled pollsters '
+                     'lets them share the domain calls of one inspection, '
+                     'the default only inspects what each pollster asks '
+                     'for. Possible fields: %s.'
+                     % ', '.join(virt_inspector.SNAPSHOT_FIELDS)),
+]
+
+cfg.CONF.register_opts(OPTS)
+
+CACHE_KEY_SNAPSHOT = 'snapshot'
+
+
+def get_snapshot(manager, cache, instance, fields, duration=None):
+    """Return the snapshot of an instance with at least the given fields.
+
+    What was inspected of an instance is kept in the poll cache for the
+    rest of the cycle, so the hypervisor is only asked for the fields no
+    other pollster needed before. A failure to inspect the instance is
+    kept as well and raised again to the following pollsters.
+    """
+    snapshots = cache.setdefault(CACHE_KEY_SNAPSHOT, {})
+    values = snapshots.setdefault(instance.id, {})
+    if isinstance(values, Exception):
+        raise values
+    missing = [field for field in fields if field not in values]
+    if missing:
+        if not values:
+            missing = set(missing).union(cfg.CONF.compute_snapshot_fields)
+            missing = [field for field in virt_inspector.SNAPSHOT_FIELDS
+                       if field in missing]
+        try:
+            snapshot = manager.inspector.inspect_snapshot(
+                util.instance_name(instance), fields=missing,
+                instance=instance, duration=duration)
+        except virt_inspector.InspectorException as err:
+            snapshots[instance.id] = err
+            raise
+        for field in missing:
+            values[field] = getattr(snapshot, field)
+    return virt_inspector.InstanceSnapshot(
+        *[values.get(field) for field in virt_inspector.SNAPSHOT_FIELDS])
@@ -0,0 +1,57 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Per-cycle sample templates shared by the compute pollsters."""
+
+from oslo.utils import timeutils
+
+from ceilometer.compute.pollsters import util
+from ceilometer import sample
+
+CACHE_KEY_TEMPLATE = 'sample-template'
+
+
+def _get_template(cache, instance):
+    templates = cache.setdefault(CACHE_KEY_TEMPLATE, {})
+    template = templates.get(instance.id)
+    if template is None:
+        # The instance metadata is built once per cycle, from a throwaway
+        # sample of make_sample_from_instance.
+        s = util.make_sample_from_instance(
+            instance, name=None, type=None, unit=None, volume=None)
+        template = (s.user_id, s.project_id, s.resource_metadata)
+        templates[instance.id] = template
+    return template
+
+
+def make_sample(cache, instance, name, type, unit, volume,
+                resource_id=None, additional_metadata=None):
+    """Return a sample of an instance, as make_sample_from_instance does.
+
+    The user, project and resource metadata of the instance are shared by
+    all its samples of the cycle, while each sample is timestamped when
+    it is built. The metadata dict is only copied for the samples with
+    additional metadata, and must not be modified.
+    """
+    user_id, project_id, metadata = _get_template(cache, instance)
+    if additional_metadata:
+        metadata = dict(metadata, **additional_metadata)
+    return sample.Sample(
+        name=name,
+        type=type,
+        unit=unit,
+        volume=volume,
+        user_id=user_id,
+        project_id=project_id,
+        resource_id=resource_id or instance.id,
+        timestamp=timeutils.isotime(),
+        resource_metadata=metadata,
+    )
@@ -0,0 +1,235 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Summaries of memory and disk activity sampled between polling cycles.
+
+A green thread inspects the instances every compute_window_interval
+seconds into fixed-size ring buffers, and the pollsters of this module
+emit the min, max, mean and 95th percentile of what was sampled since the
+previous cycle. Each instance takes WINDOW_METRICS rings of
+compute_window_size doubles, allocated once.
+"""
+
+import array
+import math
+import time
+
+try:
+    from time import monotonic as _monotonic
+except ImportError:
+    # Python 2 has no monotonic clock in the standard library.
+    _monotonic = time.time
+
+import eventlet
+from oslo.config import cfg
+
+from ceilometer.compute import plugin
+from ceilometer.compute.pollsters import template
+from ceilometer.compute.pollsters import util
+from ceilometer.compute.virt import inspector as virt_inspector
+from ceilometer.openstack.common.gettextutils import _
+from ceilometer.openstack.common import log
+from ceilometer import sample
+
+LOG = log.getLogger(__name__)
+
+OPTS = [
+    cfg.IntOpt('compute_window_interval',
+               default=0,
+               help='Number of seconds between two samples of the memory '
+                    'usage and disk rates of the instances taken between '
+                    'polling cycles, summarised by the window pollsters. 0 '
+                    'disables the sampling.'),
+    cfg.IntOpt('compute_window_size',
+               default=64,
+               help='Maximum number of samples kept per instance and metric '
+                    'between two polling cycles, the oldest being '
+                    'overwritten first.'),
+]
+
+cfg.CONF.register_opts(OPTS)
+
+# Metrics sampled for every instance, with their unit.
+WINDOW_METRICS = (
+    ('memory.usage', 'MB'),
+    ('disk.read.bytes.rate', 'B/s'),
+    ('disk.read.requests.rate', 'requests/s'),
+    ('disk.write.bytes.rate', 'B/s'),
+    ('disk.write.requests.rate', 'requests/s'),
+)
+
+# Disk counters the rates are computed from, in the order of the rate
+# metrics above.
+_DISK_COUNTERS = ('read_bytes', 'read_requests',
+                  'write_bytes', 'write_requests')
+
+
+class _Ring(object):
+    """The last samples of a metric, in a preallocated array."""
+
+    __slots__ = ('values', 'next', 'count')
+
+    def __init__(self, size):
+        self.values = array.array('d', [0.0]) * size
+        self.next = 0
+        self.count = 0
+
+    def append(self, value):
+        self.values[self.next] = value
+        self.next = (self.next + 1) % len(self.values)
+        self.count = min(self.count + 1, len(self.values))
+
+    def summarise(self):
+        """Return the (min, max, mean, p95) of the samples and clear them.
+
+        None is returned when there is no sample.
+        """
+        if not self.count:
+            return None
+        size = len(self.values)
+        values = sorted(self.values[(self.next - i - 1) % size]
+                        for i in range(self.count))
+        self.count = 0
+        # Nearest-rank percentile.
+        p95 = values[int(math.ceil(0.95 * len(values))) - 1]
+        return (values[0], values[-1], sum(values) / len(values), p95)
+
+
+class _InstanceWindow(object):
+    """The rings of an instance and its last disk counters."""
+
+    __slots__ = ('rings', 'counters', 'counters_time')
+
+    def __init__(self, size):
+        self.rings = dict((name, _Ring(size))
+                          for name, unit in WINDOW_METRICS)
+        self.counters = array.array('d', [0.0]) * len(_DISK_COUNTERS)
+        self.counters_time = None
+
+
+class _Sampler(object):
+    """Samples the tracked instances in a green thread."""
+
+    def __init__(self, inspector):
+        self.inspector = inspector
+        self.instances = {}
+        self.windows = {}
+        self._thread = None
+
+    def track(self, resources):
+        """Sample the given instances from now on, and only them."""
+        self.instances = dict((instance.id, instance)
+                              for instance in resources)
+        for instance_id in list(self.windows):
+            if instance_id not in self.instances:
+                del self.windows[instance_id]
+        if self._thread is None:
+            self._thread = eventlet.spawn(self._run)
+
+    def _run(self):
+        while True:
+            eventlet.sleep(cfg.CONF.compute_window_interval)
+            for instance in list(self.instances.values()):
+                try:
+                    self._sample(instance)
+                except virt_inspector.InspectorException as err:
+                    LOG.debug(_('Skipping window sample of %(id)s: '
+                                '%(e)s'), {'id': instance.id, 'e': err})
+                except Exception as err:
+                    LOG.exception(_('Could not sample instance %(id)s: '
+                                    '%(e)s'), {'id': instance.id, 'e': err})
+
+    def _sample(self, instance):
+        # The counters are read afresh, the rates below assuming they were
+        # read now, and are not recorded, so that the rates of the polling
+        # cycles stay computed over the polling interval.
+        snap = self.inspector.inspect_snapshot(
+            util.instance_name(instance), fields=['memory_usage', 'disks'],
+            instance=instance, record=False)
+        window = self.windows.get(instance.id)
+        if window is None:
+            window = _InstanceWindow(cfg.CONF.compute_window_size)
+            self.windows[instance.id] = window
+        if snap.memory_usage is not None:
+            window.rings['memory.usage'].append(snap.memory_usage.usage)
+        if snap.disks is None:
+            return
+        now = _monotonic()
+        totals = [sum(getattr(stats, counter) for disk, stats in snap.disks)
+                  for counter in _DISK_COUNTERS]
+        elapsed = (now - window.counters_time
+                   if window.counters_time is not None else 0)
+        # No rate for the first sample, or after the counters were reset.
+        if elapsed > 0 and all(total >= previous for total, previous
+                               in zip(totals, window.counters)):
+            for (name, unit), total, previous in zip(
+                    WINDOW_METRICS[1:], totals, window.counters):
+                window.rings[name].append((total - previous) / elapsed)
+        for i, total in enumerate(totals):
+            window.counters[i] = total
+        window.counters_time = now
+
+    def summarise(self, instance_id, name):
+        window = self.windows.get(instance_id)
+        if window is None:
+            return None
+        return window.rings[name].summarise()
+
+
+_samplers = {}
+
+
+def _get_sampler(inspector):
+    sampler = _samplers.get(id(inspector))
+    if sampler is None:
+        sampler = _samplers[id(inspector)] = _Sampler(inspector)
+    return sampler
+
+
+class _WindowPollsterBase(plugin.ComputePollster):
+    """Emit the summaries of the METRICS sampled since the last cycle."""
+
+    METRICS = ()
+
+    def get_samples(self, manager, cache, resources):
+        if cfg.CONF.compute_window_interval <= 0:
+            LOG.debug(_('%s is disabled, compute_window_interval is not '
+                        'set'), self.__class__.__name__)
+            return
+        resources = list(resources)
+        sampler = _get_sampler(manager.inspector)
+        sampler.track(resources)
+        units = dict(WINDOW_METRICS)
+        for instance in resources:
+            for name in self.METRICS:
+                summary = sampler.summarise(instance.id, name)
+                if summary is None:
+                    continue
+                for statistic, value in zip(('min', 'max', 'mean', 'p95'),
+                                            summary):
+                    yield template.make_sample(
+                        cache, instance,
+                        name='%s.%s' % (name, statistic),
+                        type=sample.TYPE_GAUGE,
+                        unit=units[name],
+                        volume=value,
+                    )
+
+
+class MemoryUsageWindowPollster(_WindowPollsterBase):
+
+    METRICS = ('memory.usage',)
+
+
+class DiskRatesWindowPollster(_WindowPollsterBase):
+
+    METRICS = ('disk.read.bytes.rate', 'disk.read.requests.rate',
+               'disk.write.bytes.rate', 'disk.write.requests.rate')
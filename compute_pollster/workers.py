@@ -0,0 +1,84 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Concurrent per-instance inspection for the compute pollsters."""
+
+import eventlet
+from eventlet import greenpool
+from eventlet import queue
+from oslo.config import cfg
+
+from ceilometer.openstack.common.gettextutils import _
+from ceilometer.openstack.common import log
+
+LOG = log.getLogger(__name__)
+
+OPTS = [
+    cfg.IntOpt('compute_pollster_workers',
+               default=0,
+               help='Number of instances inspected concurrently by the '
+                    'compute pollsters, 0 or 1 inspects them one after the '
+                    'other. Only inspector calls that yield to the eventlet '
+                    'hub can overlap.'),
+    cfg.IntOpt('compute_pollster_instance_timeout',
+               default=0,
+               help='Number of seconds after which the samples of an '
+                    'instance are given up when inspecting concurrently, '
+                    '0 waits for them indefinitely.'),
+]
+
+cfg.CONF.register_opts(OPTS)
+
+
+def iter_samples(get_samples, resources):
+    """Yield the samples of get_samples(instance) for every instance.
+
+    With compute_pollster_workers greater than 1 the instances are inspected
+    by a pool of green threads and their samples are yielded as soon as each
+    instance is done, so a slow domain only delays its own samples.
+    """
+    workers = cfg.CONF.compute_pollster_workers
+    if workers <= 1:
+        for instance in resources:
+            for s in get_samples(instance):
+                yield s
+        return
+
+    resources = list(resources)
+    results = queue.LightQueue()
+    pool = greenpool.GreenPool(workers)
+
+    def inspect(instance):
+        samples = []
+        timeout = eventlet.Timeout(
+            cfg.CONF.compute_pollster_instance_timeout or None)
+        try:
+            samples = list(get_samples(instance))
+        except eventlet.Timeout as t:
+            if t is not timeout:
+                raise
+            LOG.warn(_('Inspection of instance %s timed out, '
+                       'skipping its samples'), instance.id)
+        except Exception as err:
+            LOG.exception(_('Ignoring instance %(id)s: %(error)s'),
+                          {'id': instance.id, 'error': err})
+        finally:
+            timeout.cancel()
+            results.put(samples)
+
+    def feed():
+        for instance in resources:
+            pool.spawn_n(inspect, instance)
+
+    eventlet.spawn_n(feed)
+    for i in range(len(resources)):
+        for s in results.get():
+            yield s
@@ -0,0 +1,122 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import absolute_import
+
+from keystoneclient.auth.identity import v2
+from keystoneclient import session
+from oslo.config import cfg
+from oslo.utils import timeutils
+from ceilometer.openstack.common import log
+from ceilometer.region import region
+from ceilometer import sample
+
+
+LOG = log.getLogger(__name__)
+
+OPTS = [
+    cfg.IntOpt('hypervisor_page_size',
+               default=0,
+               help='Number of hypervisors fetched per os-hypervisors/detail '
+                    'request. Paging needs compute API microversion 2.33, 0 '
+                    'fetches all of them in a single request without it.'),
+]
+
+cfg.CONF.register_opts(OPTS, group='region')
+
+# Compute API microversion adding limit and marker to os-hypervisors.
+PAGING_MICROVERSION = '2.33'
+
+
+class HypervisorPollster(region._Base):
+    """compute.node.* meters of every hypervisor of the region.
+
+    The same meters as the HostPollster of each compute node, for all of
+    them at once from the os-hypervisors/detail listing. The listing has
+    no sum of the instance flavors, so the "max" meters are not emitted.
+    """
+
+    # compute.node.* meter, unit and os-hypervisors field
+    METERS = [
+        ('ram.tot', 'MB', 'memory_mb'),
+        ('disk.tot', 'GB', 'local_gb'),
+        ('cpu.tot', 'cpu', 'vcpus'),
+        ('ram.now', 'MB', 'memory_mb_used'),
+        ('disk.now', 'GB', 'local_gb_used'),
+        ('cpu.now', 'cpu', 'vcpus_used'),
+    ]
+
+    def __init__(self):
+        super(HypervisorPollster, self).__init__()
+        self._session = None
+
+    def _get_session(self):
+        # The session keeps its token across cycles.
+        if self._session is None:
+            creds = cfg.CONF.service_credentials
+            auth = v2.Password(auth_url=creds.os_auth_url,
+                               username=creds.os_username,
+                               password=creds.os_password,
+                               tenant_name=creds.os_tenant_name)
+            verify = False if creds.insecure else (creds.os_cacert or True)
+            self._session = session.Session(auth=auth, verify=verify)
+        return self._session
+
+    def _list_hypervisors(self):
+        """Yield every hypervisor of os-hypervisors/detail, page by page."""
+        creds = cfg.CONF.service_credentials
+        page_size = cfg.CONF.region.hypervisor_page_size
+        kwargs = {'endpoint_filter': {'service_type':
+                                      cfg.CONF.service_types.nova,
+                                      'interface': creds.os_endpoint_type,
+                                      'region_name': creds.os_region_name}}
+        url = '/os-hypervisors/detail'
+        if page_size > 0:
+            url += '?limit=%d' % page_size
+            kwargs['headers'] = {'X-OpenStack-Nova-API-Version':
+                                 PAGING_MICROVERSION}
+        while url:
+            body = self._get_session().get(url, **kwargs).json()
+            for hypervisor in body.get('hypervisors', []):
+                yield hypervisor
+            # Absolute, and only returned while there are more pages.
+            url = None
+            for link in body.get('hypervisors_links', []):
+                if link.get('rel') == 'next':
+                    url = link['href']
+                    kwargs.pop('endpoint_filter', None)
+
+    def get_samples(self, manager, cache, resources):
+        try:
+            hypervisors = list(self._list_hypervisors())
+        except Exception as e:
+            LOG.error(e)
+            raise e
+
+        timestamp = timeutils.isotime()
+        for hypervisor in hypervisors:
+            host = (hypervisor.get('service') or {}).get('host')
+            nodename = hypervisor.get('hypervisor_hostname')
+            if not host or not nodename:
+                continue
+            for name, unit, field in self.METERS:
+                yield sample.Sample(
+                    name="compute.node.%s" % name,
+                    type=sample.TYPE_GAUGE,
+                    unit=unit,
+                    volume=hypervisor.get(field) or 0,
+                    user_id=None,
+                    project_id=None,
+                    resource_id="%s_%s" % (host, nodename),
+                    timestamp=timestamp,
+                    resource_metadata={}
+                )
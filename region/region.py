@@ -76,26 +76,33 @@ class RegionPollster(_Base):
         subNetId = list()
         regionArray = list()
         try:
-            nL = neutron.list_networks()
+            nL = neutron.list_networks(fields=['id', 'name', 'subnets'])
         except Exception as e:
             LOG.error(e)
             raise e
 
         # compute the size of the pool
+        netId = list()
         if nL and "networks" in nL:
             for nLi in nL["networks"]:
                 if ("id" in nLi) and ("name" in nLi) and nLi["name"] in cfg.CONF.region.netlist and  ("subnets" in nLi):
-                    for sNi in nLi['subnets']:
-                        sN = neutron.show_subnet(sNi)
-                        if ("subnet" in sN) and ("cidr" in sN["subnet"]) and ("allocation_pools" in sN["subnet"]):
-                            subNetId.append(sN['subnet']['id'])
-                            if sN["subnet"]["allocation_pools"] and len(sN["subnet"]["allocation_pools"]) > 0:
-                                for pool in sN["subnet"]["allocation_pools"]:
-                                    subNet.append(IPRange(pool["start"], pool["end"]))
-                                    pool_size += len(IPRange(pool["start"], pool["end"]))
+                    netId.append(nLi["id"])
+        # one request for the subnets of all the networks, an empty
+        # network_id filter would list every subnet
+        if netId:
+            sL = neutron.list_subnets(network_id=netId,
+                                      fields=['id', 'cidr', 'allocation_pools'])
+            for sN in sL.get("subnets", []):
+                if ("cidr" in sN) and ("allocation_pools" in sN):
+                    subNetId.append(sN['id'])
+                    if sN["allocation_pools"] and len(sN["allocation_pools"]) > 0:
+                        for pool in sN["allocation_pools"]:
+                            subNet.append(IPRange(pool["start"], pool["end"]))
+                            pool_size += len(IPRange(pool["start"], pool["end"]))
 
         # compute the IP usage
-        netF = neutron.list_floatingips()
+        netF = neutron.list_floatingips(
+            fields=['floating_ip_address', 'fixed_ip_address'])
         if netF and "floatingips" in netF:
             for netFi in netF["floatingips"]:
                 for tmp_pool in subNet:
@@ -107,7 +114,7 @@ class RegionPollster(_Base):
                         break
 
         # check if some routers are using IPs
-        r_L = neutron.list_routers()
+        r_L = neutron.list_routers(fields=['external_gateway_info'])
         if "routers" in r_L:
             for r_li in r_L["routers"]:
                 if "external_gateway_info" in r_li \
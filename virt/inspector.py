@@ -59,6 +59,13 @@ CPUStats = collections.namedtuple('CPUStats', ['number', 'time'])
 #
 CPUUtilStats = collections.namedtuple('CPUUtilStats', ['util'])
 
+# Named tuple representing per vCPU Utilization statistics.
+#
+# number: the vCPU number
+# util: CPU utilization of the vCPU in percentage
+#
+VCPUUtilStats = collections.namedtuple('VCPUUtilStats', ['number', 'util'])
+
 # Named tuple representing Memory usage statistics.
 #
 # usage: Amount of memory used
@@ -66,6 +73,24 @@ CPUUtilStats = collections.namedtuple('CPUUtilStats', ['util'])
 MemoryUsageStats = collections.namedtuple('MemoryUsageStats', ['usage'])
 MemoryResidentStats = collections.namedtuple('MemoryResidentStats', ['resident'])
 
+# Named tuple representing the memory statistics of the balloon driver.
+#
+# available: amount of memory seen by the guest, in MB
+# unused: amount of memory left unused by the guest, in MB
+# rss: resident set size of the process running the guest, in MB
+# actual: current balloon size, in MB
+# swap_in: cumulative amount of memory swapped in, in MB
+# swap_out: cumulative amount of memory swapped out, in MB
+# major_fault: cumulative number of major page faults
+# minor_fault: cumulative number of minor page faults
+#
+# Statistics the guest does not report are None.
+#
+MemoryStats = collections.namedtuple('MemoryStats',
+                                     ['available', 'unused', 'rss', 'actual',
+                                      'swap_in', 'swap_out',
+                                      'major_fault', 'minor_fault'])
+
 # Named tuple representing vNICs.
 #
 # name: the name of the vNIC
@@ -138,6 +163,41 @@ DiskInfo = collections.namedtuple('DiskInfo',
                                    'physical'])
 
 
+# Named tuple representing the capacity of the host and what its
+# instances take of it.
+#
+# memory_total: memory of the host, in MB
+# memory_free: memory left free on the host, in MB
+# vcpus_total: number of physical CPUs of the host
+# vcpus_used: number of vCPUs of the running instances
+# vcpus_allocated: number of vCPUs of all the instances
+# memory_allocated: maximum memory of all the instances, in MB
+# disk_allocated: capacity of the disks of all the instances, in GB
+#
+HostCapacity = collections.namedtuple('HostCapacity',
+                                      ['memory_total', 'memory_free',
+                                       'vcpus_total', 'vcpus_used',
+                                       'vcpus_allocated', 'memory_allocated',
+                                       'disk_allocated'])
+
+
+# Fields of an instance snapshot, each named after the inspect_* method
+# providing its value.
+#
+SNAPSHOT_FIELDS = ('cpu', 'cpu_util', 'vcpu_util', 'memory_usage',
+                   'memory_resident', 'memory_stats', 'disks', 'disk_rates',
+                   'disk_info', 'vnics')
+
+# Named tuple representing what was inspected of an instance in one go.
+#
+# Each field holds what the matching inspect_* method returns, with the
+# per-device results as lists, or None when the field was not requested
+# or the inspector could not provide it.
+#
+InstanceSnapshot = collections.namedtuple('InstanceSnapshot',
+                                          SNAPSHOT_FIELDS)
+
+
 # Exception types
 #
 class InspectorException(Exception):
@@ -149,6 +209,10 @@ class InstanceNotFoundException(InspectorException):
     pass
 
 
+class HypervisorUnavailableException(InspectorException):
+    pass
+
+
 # Main virt inspector abstraction layering over the hypervisor API.
 #
 class Inspector(object):
@@ -191,6 +255,16 @@ class Inspector(object):
         """
         raise ceilometer.NotImplementedError
 
+    def inspect_vcpu_util(self, instance, duration=None):
+        """Inspect the CPU Utilization (%) of every vCPU of an instance.
+
+        :param instance: the target instance
+        :param duration: the last 'n' seconds, over which the value should be
+               inspected
+        :return: for each vCPU, the percentage of CPU utilization
+        """
+        raise ceilometer.NotImplementedError
+
     def inspect_vnics(self, instance_name):
         """Inspect the vNIC statistics for an instance.
 
@@ -239,6 +313,28 @@ class Inspector(object):
         """
         raise ceilometer.NotImplementedError
 
+    def inspect_memory_stats(self, instance_name):
+        """Inspect the balloon memory statistics for an instance.
+
+        :param instance_name: the name of the target instance
+        :return: the MemoryStats of the instance
+        """
+        raise ceilometer.NotImplementedError
+
+    def inspect_host_capacity(self):
+        """Inspect the capacity of the host and its use by the instances.
+
+        :return: the HostCapacity of the host
+        """
+        raise ceilometer.NotImplementedError
+
+    def inspect_domains_without_balloon_stats(self):
+        """Count the instances of the host lacking balloon statistics.
+
+        :return: the number of instances whose memory usage could not be
+                 read from the balloon driver when last inspected
+        """
+        raise ceilometer.NotImplementedError
 
     def inspect_disk_rates(self, instance, duration=None):
         """Inspect the disk statistics as rates for an instance.
@@ -251,6 +347,66 @@ class Inspector(object):
         """
         raise ceilometer.NotImplementedError
 
+    def inspect_snapshot(self, instance_name, fields=None, instance=None,
+                         duration=None, record=True):
+        """Inspect several statistics of an instance together.
+
+        :param instance_name: the name of the target instance
+        :param fields: the SNAPSHOT_FIELDS to inspect, all of them if None
+        :param instance: the target instance, needed by the rate fields
+        :param duration: the last 'n' seconds, over which the rates should
+               be inspected
+        :param record: False for reads made between the polling cycles,
+               which neither feed the counters kept for the rates of later
+               calls nor use statistics shared with other calls
+        :return: an InstanceSnapshot
+        """
+        def rates(method):
+            if instance is None:
+                raise ceilometer.NotImplementedError
+            return method(instance, duration)
+
+        return self._build_snapshot(instance_name, fields, {
+            'cpu': lambda: self.inspect_cpus(instance_name),
+            'cpu_util': lambda: rates(self.inspect_cpu_util),
+            'vcpu_util': lambda: list(rates(self.inspect_vcpu_util)),
+            'memory_usage': lambda: self.inspect_memory_usage(instance_name),
+            'memory_resident':
+                lambda: self.inspect_memory_resident(instance_name),
+            'memory_stats': lambda: self.inspect_memory_stats(instance_name),
+            'disks': lambda: list(self.inspect_disks(instance_name)),
+            'disk_rates': lambda: list(rates(self.inspect_disk_rates)),
+            'disk_info': lambda: list(self.inspect_disk_info(instance_name)),
+            'vnics': lambda: list(self.inspect_vnics(instance_name)),
+        })
+
+    def _build_snapshot(self, instance_name, fields, inspectors):
+        values = {}
+        for field in SNAPSHOT_FIELDS:
+            if fields is not None and field not in fields:
+                continue
+            try:
+                values[field] = inspectors[field]()
+            except ceilometer.NotImplementedError:
+                pass
+            except InspectorException:
+                raise
+            except Exception as ex:
+                self._snapshot_field_failed(instance_name, field, ex)
+        return InstanceSnapshot(*[values.get(field)
+                                  for field in SNAPSHOT_FIELDS])
+
+    def _snapshot_field_failed(self, instance_name, field, ex):
+        """Handle the failure to inspect one field of a snapshot.
+
+        The field is left empty so that the other fields are still
+        reported, raising instead fails the whole snapshot.
+        """
+        LOG.warn(_('Failed to inspect %(field)s of %(instance_name)s: '
+                   '%(error)s'),
+                 {'field': field, 'instance_name': instance_name,
+                  'error': ex})
+
 
 def get_hypervisor_inspector():
     try:
@@ -16,10 +16,16 @@
 # under the License.
 """Implementation of Inspector abstraction for libvirt."""
 
+import collections
+import time
+
+from eventlet import patcher
+from eventlet import tpool
 from lxml import etree
 from oslo.config import cfg
 import six
 
+from ceilometer.compute.pollsters import util
 from ceilometer.compute.virt import inspector as virt_inspector
 from ceilometer.openstack.common.gettextutils import _
 from ceilometer.openstack.common import log as logging
@@ -27,8 +33,16 @@ from ceilometer.openstack.common import log as logging
 #last added
 from oslo_utils import units
 
+try:
+    from time import monotonic as _monotonic
+except ImportError:
+    # Python 2 has no monotonic clock in the standard library.
+    _monotonic = time.time
+
 libvirt = None
 
+native_threading = patcher.original('threading')
+
 LOG = logging.getLogger(__name__)
 
 libvirt_opts = [
@@ -40,28 +54,372 @@ libvirt_opts = [
                default='',
                help='Override the default libvirt URI '
                     '(which is dependent on libvirt_type).'),
+    cfg.BoolOpt('libvirt_bulk_stats',
+                default=False,
+                help='Collect the statistics of all the domains with a '
+                     'single getAllDomainStats call per polling cycle '
+                     'instead of querying every domain separately '
+                     '(requires libvirt >= 1.2.8).'),
+    cfg.IntOpt('libvirt_bulk_stats_max_age',
+               default=10,
+               help='Number of seconds an all-domains statistics snapshot '
+                    'is reused before being refreshed. It should be lower '
+                    'than the pipeline interval.'),
+    cfg.BoolOpt('libvirt_domain_events',
+                default=False,
+                help='Subscribe to libvirt domain events, dispatched by a '
+                     'native thread running the libvirt event loop, so '
+                     'that data cached per domain (such as the disk and '
+                     'vNIC topology) is only refreshed when the domain '
+                     'changes, and instances are listed from an in-memory '
+                     'domain inventory.'),
+    cfg.IntOpt('libvirt_domain_cache_size',
+               default=256,
+               help='Maximum number of libvirt domain handles kept to avoid '
+                    'looking the domains up by name on every inspect call. '
+                    'Least recently used handles are dropped first, 0 '
+                    'disables the cache.'),
+    cfg.IntOpt('libvirt_counter_history',
+               default=4,
+               help='Number of cumulative disk and vNIC counter samples '
+                    'kept per device to compute rates locally.'),
+    cfg.IntOpt('libvirt_counter_max_age',
+               default=10,
+               help='Number of seconds the counters read by an inspect call '
+                    'are reused to compute rates before they are read '
+                    'again. Samples closer than this are never used as the '
+                    'base of a rate.'),
+    cfg.IntOpt('libvirt_thread_pool_size',
+               default=0,
+               help='Number of native threads running the libvirt calls, '
+                    'so that a slow hypervisor does not block the green '
+                    'threads of the agent. 0 runs the calls in the calling '
+                    'green thread.'),
+    cfg.IntOpt('libvirt_keepalive_interval',
+               default=0,
+               help='Number of seconds between the keepalive messages sent '
+                    'to libvirtd so that a dead connection is detected '
+                    'without waiting for a call to fail. 0 disables '
+                    'keepalive, enabling it runs the libvirt event loop.'),
+    cfg.IntOpt('libvirt_keepalive_count',
+               default=5,
+               help='Number of keepalive messages left unanswered before '
+                    'the connection is considered dead.'),
+    cfg.IntOpt('libvirt_reconnect_interval',
+               default=1,
+               help='Number of seconds to wait after a failed connection to '
+                    'libvirt before trying again. The delay doubles after '
+                    'every consecutive failure and inspect calls fail '
+                    'immediately in the meantime.'),
+    cfg.IntOpt('libvirt_reconnect_max_interval',
+               default=60,
+               help='Maximum number of seconds to wait between two '
+                    'connection attempts to libvirt.'),
+    cfg.IntOpt('libvirt_connection_pool_size',
+               default=1,
+               help='Number of read-only libvirt connections used in turn '
+                    'by the inspect calls, useful when instances are '
+                    'inspected concurrently.'),
+    cfg.IntOpt('libvirt_disk_info_refresh',
+               default=300,
+               help='Number of seconds the capacity, allocation and '
+                    'physical size of a disk read with blockInfo are reused '
+                    'before they are read again. A disk is also read again '
+                    'whenever its domain is redefined, started, stopped or '
+                    'gets a device attached or detached. The disks are only '
+                    'cached when libvirt_domain_events is set, as these '
+                    'changes go unnoticed without it. 0 reads them on every '
+                    'inspect call.'),
+    cfg.IntOpt('libvirt_memory_stats_period',
+               default=0,
+               help='Number of seconds between two balloon statistics '
+                    'updates, set with setMemoryStatsPeriod on the domains '
+                    'found without balloon statistics. This opens a '
+                    'read-write libvirt connection. 0 leaves the period of '
+                    'the domains unchanged.'),
+    cfg.IntOpt('libvirt_memory_stats_max_age',
+               default=300,
+               help='Number of seconds the last memory usage read from the '
+                    'balloon statistics of a domain is still reported once '
+                    'they are missing.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(libvirt_opts)
 
 
+# Named tuple representing the bulk statistics of a domain.
+#
+# domain: the virDomain handle returned along with the statistics
+# state: the domain state
+# stats: the flat statistics dict returned by libvirt
+# block: the per-disk statistics, one dict per disk
+# net: the per-interface statistics, one dict per interface
+#
+DomainStats = collections.namedtuple('DomainStats',
+                                     ['domain', 'state', 'stats',
+                                      'block', 'net'])
+
+
+# Named tuple representing the device topology of a domain.
+#
+# disks: the target devices of the disks
+# interfaces: the Interface tuples of the vNICs
+#
+DomainTopology = collections.namedtuple('DomainTopology',
+                                        ['disks', 'interfaces'])
+
+# Named tuple representing a domain of the inventory.
+#
+# instance: the Instance tuple of the domain
+# state: the last known domain state
+#
+InventoryEntry = collections.namedtuple('InventoryEntry',
+                                        ['instance', 'state'])
+
+_event_loop_thread = None
+_thread_pool_started = False
+
+
+def _run_event_loop():
+    while True:
+        libvirt.virEventRunDefaultImpl()
+
+
+def _start_event_loop():
+    """Run the libvirt default event loop in a native thread, once.
+
+    It has to be registered before the connection is opened.
+    """
+    global _event_loop_thread
+    if _event_loop_thread is None:
+        libvirt.virEventRegisterDefaultImpl()
+        _event_loop_thread = native_threading.Thread(
+            target=_run_event_loop, name='libvirt-event-loop')
+        _event_loop_thread.daemon = True
+        _event_loop_thread.start()
+
+
+def _start_thread_pool():
+    global _thread_pool_started
+    if not _thread_pool_started:
+        tpool.set_num_threads(CONF.libvirt_thread_pool_size)
+        _thread_pool_started = True
+
+
+def _split_device_stats(stats, group, count=None):
+    """Turn the flat '<group>.<n>.<field>' keys into one dict per device."""
+    if count is None:
+        count = stats.get('%s.count' % group, 0)
+    devices = [{} for i in range(count)]
+    prefix = group + '.'
+    for key, value in six.iteritems(stats):
+        if not key.startswith(prefix):
+            continue
+        index, sep, field = key[len(prefix):].partition('.')
+        if sep and index.isdigit() and int(index) < len(devices):
+            devices[int(index)][field] = value
+    return devices
+
+
+def _is_connection_broken(ex):
+    return (libvirt is not None and isinstance(ex, libvirt.libvirtError) and
+            ex.get_error_code() == libvirt.VIR_ERR_SYSTEM_ERROR and
+            ex.get_error_domain() in (libvirt.VIR_FROM_REMOTE,
+                                      libvirt.VIR_FROM_RPC))
+
+
 def retry_on_disconnect(function):
     def decorator(self, *args, **kwargs):
         try:
             return function(self, *args, **kwargs)
         except libvirt.libvirtError as e:
-            if (e.get_error_code() == libvirt.VIR_ERR_SYSTEM_ERROR and
-                e.get_error_domain() in (libvirt.VIR_FROM_REMOTE,
-                                         libvirt.VIR_FROM_RPC)):
+            if _is_connection_broken(e):
                 LOG.debug('Connection to libvirt broken')
-                self.connection = None
+                self._reset_connection()
                 return function(self, *args, **kwargs)
             else:
                 raise
     return decorator
 
 
+class CounterHistory(object):
+    """Ring buffers of recent cumulative counters, one per device.
+
+    Every sample is a (timestamp, counters) tuple taken with a monotonic
+    clock, counters being a tuple of integers. Owners (an instance and a
+    kind of device) that are not updated for an hour are forgotten.
+    """
+
+    EXPIRY = 3600
+
+    def __init__(self):
+        self._rings = {}
+        self._updated = {}
+        self._expired = _monotonic()
+
+    def record(self, owner, samples):
+        """Record the (name, device, counters) samples read for an owner."""
+        now = _monotonic()
+        for name, device, counters in samples:
+            ring = self._rings.get((owner, name))
+            if ring is None:
+                ring = collections.deque(maxlen=CONF.libvirt_counter_history)
+                self._rings[(owner, name)] = ring
+            ring.append((now, counters))
+        self._updated[owner] = (now, [(name, device)
+                                      for name, device, c in samples])
+        if now - self._expired > self.EXPIRY:
+            self._expire(now)
+
+    def age(self, owner):
+        updated = self._updated.get(owner)
+        if updated is None:
+            return float('inf')
+        return _monotonic() - updated[0]
+
+    def rates(self, owner, duration=None):
+        """Yield the (device, per second rates) of the last recorded devices.
+
+        The rates are computed between the newest sample and the oldest one
+        no older than duration, or the previous one without duration, and
+        samples closer than libvirt_counter_max_age to the newest are not
+        used. A device is skipped until it has two usable samples, and when
+        one of its counters went backwards, as happens on a domain reboot.
+        """
+        devices = self._updated.get(owner, (None, []))[1]
+        for name, device in devices:
+            ring = self._rings.get((owner, name))
+            if not ring or len(ring) < 2:
+                continue
+            newest, counters = ring[-1]
+            base = None
+            for timestamp, previous in reversed(list(ring)[:-1]):
+                elapsed = newest - timestamp
+                if elapsed < CONF.libvirt_counter_max_age:
+                    continue
+                if base is not None and (not duration or elapsed > duration):
+                    break
+                base = (elapsed, previous)
+            if base is None:
+                continue
+            elapsed, previous = base
+            if any(c < p for c, p in zip(counters, previous)):
+                LOG.debug('Counters of %(device)s went backwards, '
+                          'skipping its rates', {'device': name})
+                # Only the samples after the reset are meaningful.
+                while len(ring) > 1:
+                    ring.popleft()
+                continue
+            yield device, tuple((c - p) / float(elapsed)
+                                for c, p in zip(counters, previous))
+
+    def _expire(self, now):
+        self._expired = now
+        for owner, (updated, devices) in list(self._updated.items()):
+            if now - updated > self.EXPIRY:
+                del self._updated[owner]
+        for key in list(self._rings):
+            if key[0] not in self._updated:
+                del self._rings[key]
+
+
+def _is_missing_domain(ex):
+    return (libvirt is not None and isinstance(ex, libvirt.libvirtError) and
+            ex.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN)
+
+
+def evict_on_missing_domain(function):
+    """Drop the cached handle of a domain libvirt no longer knows about.
+
+    The error is then reported as InstanceNotFoundException, just like a
+    failed lookup of the domain. The decorated method takes either the name
+    of the instance or the instance itself.
+
+    Calls on a cached handle bypass the connection, so a broken connection
+    is handled here like retry_on_disconnect does: the connection and the
+    cached handles are reset and the method is retried once.
+    """
+    def evict(self, instance_name, ex):
+        if not isinstance(instance_name, six.string_types):
+            instance_name = util.instance_name(instance_name)
+        self._evict_domain(instance_name)
+        raise virt_inspector.InstanceNotFoundException(six.text_type(ex))
+
+    def call(self, instance_name, *args, **kwargs):
+        try:
+            return function(self, instance_name, *args, **kwargs)
+        except Exception as ex:
+            if not _is_missing_domain(ex):
+                raise
+            evict(self, instance_name, ex)
+
+    def decorator(self, instance_name, *args, **kwargs):
+        try:
+            return call(self, instance_name, *args, **kwargs)
+        except libvirt.libvirtError as ex:
+            if not _is_connection_broken(ex):
+                raise
+            LOG.debug('Connection to libvirt broken')
+            self._reset_connection()
+            return call(self, instance_name, *args, **kwargs)
+    return decorator
+
+
+class _DomainContext(object):
+    """What an inspect call knows of a domain.
+
+    The handle, info(), memoryStats() and device topology of the domain
+    are fetched at most once, and only when neither the bulk statistics
+    nor the domain inventory already provide the data. Unless record is
+    set, the counters read are not kept for the rates of later calls and
+    the bulk statistics, which may be older than the call, are not used.
+    """
+
+    def __init__(self, inspector, instance_name, record=True):
+        self.inspector = inspector
+        self.name = instance_name
+        self.record = record
+        self.stats = None
+        if record:
+            self.stats = inspector._get_domain_stats(instance_name)
+        self._domain = None
+        self._info = None
+        self._memory_stats = None
+        self._topology = None
+
+    @property
+    def domain(self):
+        if self._domain is None:
+            self._domain = self.inspector._get_domain(self.name, self.stats)
+        return self._domain
+
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = self.domain.info()
+        return self._info
+
+    @property
+    def state(self):
+        state = self.inspector._get_known_state(self.name, self.stats)
+        if state is None:
+            state = self.info[0]
+        return state
+
+    @property
+    def topology(self):
+        if self._topology is None:
+            self._topology = self.inspector._get_topology(self.domain)
+        return self._topology
+
+    @property
+    def memory_stats(self):
+        if self._memory_stats is None:
+            self._memory_stats = self.domain.memoryStats()
+        return self._memory_stats
+
+
 class LibvirtInspector(virt_inspector.Inspector):
 
     per_type_uris = dict(uml='uml:///system', xen='xen:///', lxc='lxc:///')
@@ -69,32 +427,363 @@ class LibvirtInspector(virt_inspector.Inspector):
     def __init__(self):
         self.uri = self._get_uri()
         self.connection = None
+        self._bulk_stats = None
+        self._bulk_stats_time = 0
+        self._bulk_stats_supported = True
+        self._domain_events = False
+        self._topology = {}
+        self._inventory = None
+        self._event_generation = 0
+        self._domains = collections.OrderedDict()
+        self.cache_stats = collections.Counter()
+        self._counters = CounterHistory()
+        self._pool = []
+        self._pool_index = 0
+        self._connection_closed = False
+        self._connect_failures = 0
+        self._connect_retry_at = 0
+        self._block_info = {}
+        self._block_info_expire_at = 0
+        self._rw_connection = None
+        # domain event callback IDs registered on self.connection
+        self._event_callbacks = []
+        # domain UUID -> time its balloon stats period was set
+        self._stats_period_set = {}
+        # instance name -> (last memory usage read, time it was read)
+        self._memory_usage = {}
+        # instance name -> time it was last found without balloon stats
+        self._no_balloon_stats = {}
 
     def _get_uri(self):
         return CONF.libvirt_uri or self.per_type_uris.get(CONF.libvirt_type,
                                                           'qemu:///system')
 
+    def _reset_connection(self):
+        # Handles and statistics of the old connection are unusable.
+        self._close_connections()
+        self.connection = None
+        self._pool = []
+        self._domains.clear()
+        self._bulk_stats = None
+        self._rw_connection = None
+
+    def _close_connections(self):
+        """Close the connections, dropping the callbacks registered on them.
+
+        The callbacks keep the connections alive, and one reset while not
+        actually dead would keep delivering events.
+        """
+        for callback_id in self._event_callbacks:
+            try:
+                self.connection.domainEventDeregisterAny(callback_id)
+            except libvirt.libvirtError as e:
+                LOG.debug('Unable to deregister a domain event callback: %s',
+                          e)
+        self._event_callbacks = []
+        self._domain_events = False
+        for conn in self._pool:
+            if CONF.libvirt_keepalive_interval > 0:
+                try:
+                    conn.unregisterCloseCallback()
+                except (AttributeError, libvirt.libvirtError) as e:
+                    LOG.debug('Unable to unregister the close callback: %s',
+                              e)
+        for conn in self._pool + [self._rw_connection]:
+            if conn is None:
+                continue
+            try:
+                conn.close()
+            except libvirt.libvirtError as e:
+                LOG.debug('Unable to close the connection to libvirt: %s', e)
+
     def _get_connection(self):
+        """Return one of the libvirt connections, connecting if needed.
+
+        After a failed connection attempt, further attempts are delayed
+        with an exponential backoff and HypervisorUnavailableException is
+        raised right away until then, so that a libvirtd restart costs a
+        single failure per polling cycle.
+        """
+        if self._connection_closed:
+            LOG.debug('Connection to libvirt closed')
+            self._connection_closed = False
+            self._reset_connection()
         if not self.connection:
             global libvirt
             if libvirt is None:
                 libvirt = __import__('libvirt')
+            now = _monotonic()
+            if now < self._connect_retry_at:
+                raise virt_inspector.HypervisorUnavailableException(
+                    _('libvirt is unavailable, next connection attempt in '
+                      '%ds') % (self._connect_retry_at - now))
             LOG.debug('Connecting to libvirt: %s', self.uri)
-            self.connection = libvirt.openReadOnly(self.uri)
+            if (CONF.libvirt_domain_events or
+                    CONF.libvirt_keepalive_interval > 0):
+                _start_event_loop()
+            try:
+                pool = [self._connect()
+                        for i in range(max(CONF.libvirt_connection_pool_size,
+                                           1))]
+            except libvirt.libvirtError as e:
+                self._connect_failures += 1
+                backoff = min(CONF.libvirt_reconnect_interval *
+                              2 ** (self._connect_failures - 1),
+                              CONF.libvirt_reconnect_max_interval)
+                self._connect_retry_at = now + backoff
+                LOG.warn(_('Unable to connect to libvirt, next attempt in '
+                           '%(backoff)ds: %(error)s'),
+                         {'backoff': backoff, 'error': e})
+                raise virt_inspector.HypervisorUnavailableException(
+                    six.text_type(e))
+            self._connect_failures = 0
+            self._connect_retry_at = 0
+            self._pool = pool
+            self.connection = pool[0]
+            if CONF.libvirt_domain_events:
+                self._register_domain_events(self.connection)
+
+        if len(self._pool) < 2:
+            return self.connection
+        self._pool_index = (self._pool_index + 1) % len(self._pool)
+        return self._pool[self._pool_index]
+
+    def _connect(self):
+        if CONF.libvirt_thread_pool_size > 0:
+            # Every call on the connection and on the domains it
+            # returns is run by a native thread of the eventlet pool.
+            _start_thread_pool()
+            conn = tpool.proxy_call((libvirt.virDomain, libvirt.virConnect),
+                                    libvirt.openReadOnly, self.uri)
+        else:
+            conn = libvirt.openReadOnly(self.uri)
+        if CONF.libvirt_keepalive_interval > 0:
+            try:
+                conn.setKeepAlive(CONF.libvirt_keepalive_interval,
+                                  CONF.libvirt_keepalive_count)
+                conn.registerCloseCallback(self._close_event, None)
+            except (AttributeError, libvirt.libvirtError) as e:
+                LOG.warn(_('Unable to enable libvirt keepalive: %s'), e)
+        return conn
+
+    def _get_rw_connection(self):
+        # setMemoryStatsPeriod is refused on read-only connections.
+        if self._rw_connection is None:
+            if CONF.libvirt_thread_pool_size > 0:
+                _start_thread_pool()
+                self._rw_connection = tpool.proxy_call(
+                    (libvirt.virDomain, libvirt.virConnect),
+                    libvirt.open, self.uri)
+            else:
+                self._rw_connection = libvirt.open(self.uri)
+        return self._rw_connection
+
+    def _close_event(self, conn, reason, opaque):
+        # Called from the event loop thread, the connections are reset by
+        # the next _get_connection call.
+        self._connection_closed = True
+
+    @staticmethod
+    def _wrap_domain(domain):
+        """Run the calls on a domain in the native thread pool, if enabled.
+
+        Only domains returned directly by the connection are wrapped
+        automatically, not those nested in a returned list.
+        """
+        if CONF.libvirt_thread_pool_size > 0:
+            return tpool.Proxy(domain)
+        return domain
+
+    def _register_domain_events(self, conn):
+        # Events may have been missed while disconnected.
+        self._event_generation += 1
+        self._invalidate_topology()
+        self._inventory = None
+        try:
+            self._event_callbacks.append(conn.domainEventRegisterAny(
+                None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                self._lifecycle_event, None))
+            for event_id in (libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_ADDED,
+                             libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED):
+                self._event_callbacks.append(conn.domainEventRegisterAny(
+                    None, event_id, self._device_event, None))
+        except (AttributeError, libvirt.libvirtError) as e:
+            LOG.warn(_('Unable to subscribe to libvirt domain events, '
+                       'domain topology will not be cached: %s'), e)
+            self._domain_events = False
+        else:
+            self._domain_events = True
+
+    def _lifecycle_event(self, conn, domain, event, detail, opaque):
+        # Called from the event loop thread, the generation lets the
+        # readers detect an event racing with their own libvirt calls.
+        self._event_generation += 1
+        # Started and stopped domains get a new live XML.
+        if event in (libvirt.VIR_DOMAIN_EVENT_DEFINED,
+                     libvirt.VIR_DOMAIN_EVENT_UNDEFINED,
+                     libvirt.VIR_DOMAIN_EVENT_STARTED,
+                     libvirt.VIR_DOMAIN_EVENT_STOPPED):
+            self._invalidate_topology(domain.UUIDString())
+        if event == libvirt.VIR_DOMAIN_EVENT_STARTED:
+            # A new QEMU process starts without a balloon stats period.
+            self._stats_period_set.pop(domain.UUIDString(), None)
+        elif event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+            self._memory_usage.pop(domain.name(), None)
+            self._no_balloon_stats.pop(domain.name(), None)
+        inventory = self._inventory
+        if inventory is not None:
+            self._update_inventory(inventory, domain, event)
 
-        return self.connection
+    def _device_event(self, conn, domain, device, opaque):
+        self._event_generation += 1
+        self._invalidate_topology(domain.UUIDString())
+
+    @staticmethod
+    def _update_inventory(inventory, domain, event):
+        name = domain.name()
+        if event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+            inventory.pop(name, None)
+            return
+        if event == libvirt.VIR_DOMAIN_EVENT_DEFINED:
+            # A redefinition does not change the state of the domain.
+            entry = inventory.get(name)
+            state = (entry.state if entry is not None
+                     else libvirt.VIR_DOMAIN_SHUTOFF)
+        else:
+            state = {
+                libvirt.VIR_DOMAIN_EVENT_STARTED: libvirt.VIR_DOMAIN_RUNNING,
+                libvirt.VIR_DOMAIN_EVENT_SUSPENDED: libvirt.VIR_DOMAIN_PAUSED,
+                libvirt.VIR_DOMAIN_EVENT_RESUMED: libvirt.VIR_DOMAIN_RUNNING,
+                libvirt.VIR_DOMAIN_EVENT_STOPPED: libvirt.VIR_DOMAIN_SHUTOFF,
+                libvirt.VIR_DOMAIN_EVENT_PMSUSPENDED:
+                    libvirt.VIR_DOMAIN_PMSUSPENDED,
+                libvirt.VIR_DOMAIN_EVENT_CRASHED: libvirt.VIR_DOMAIN_CRASHED,
+            }.get(event)
+            if state is None:
+                return
+        inventory[name] = InventoryEntry(
+            instance=virt_inspector.Instance(name=name,
+                                             UUID=domain.UUIDString()),
+            state=state)
+
+    def _build_inventory(self, conn):
+        try:
+            records = conn.getAllDomainStats(libvirt.VIR_DOMAIN_STATS_STATE)
+            states = [(domain, record.get('state.state'))
+                      for domain, record in records]
+        except (AttributeError, libvirt.libvirtError) as e:
+            if (isinstance(e, libvirt.libvirtError) and
+                    e.get_error_code() != libvirt.VIR_ERR_NO_SUPPORT):
+                raise
+            states = [(domain, self._wrap_domain(domain).state()[0])
+                      for domain in conn.listAllDomains()]
+        inventory = {}
+        for domain, state in states:
+            if domain.ID() == 0:
+                # Skip the Xen control domain, as listDomainsID did.
+                continue
+            inventory[domain.name()] = InventoryEntry(
+                instance=virt_inspector.Instance(name=domain.name(),
+                                                 UUID=domain.UUIDString()),
+                state=state)
+        return inventory
 
     @retry_on_disconnect
+    def _get_inventory(self):
+        """Return the domain inventory, or None without domain events.
+
+        The inventory is built once per connection and then kept current
+        by the lifecycle events, so reading it costs no libvirt call.
+        """
+        conn = self._get_connection()
+        if not self._domain_events:
+            return None
+        # Rebuild if an event raced with the listing.
+        for attempt in range(3):
+            if self._inventory is not None:
+                break
+            generation = self._event_generation
+            inventory = self._build_inventory(conn)
+            if generation == self._event_generation:
+                self._inventory = inventory
+        return self._inventory
+
+    def _get_known_state(self, instance_name, dom_stats=None):
+        """Return the domain state known without a libvirt call, or None."""
+        if dom_stats is not None:
+            return dom_stats.state
+        inventory = self._inventory
+        if inventory is not None and instance_name in inventory:
+            return inventory[instance_name].state
+        return None
+
+    def _invalidate_topology(self, uuid=None):
+        # The block info of the disks goes along with the topology.
+        if uuid is None:
+            self._topology.clear()
+            self._block_info.clear()
+        else:
+            self._topology.pop(uuid, None)
+            self._block_info.pop(uuid, None)
+
+    def _get_topology(self, domain):
+        """Return the disk and vNIC topology of a domain.
+
+        The topology is cached by domain UUID and the domain XML is only
+        fetched and parsed again once libvirt reports a device attach or
+        detach, or the domain being redefined, started or stopped. Without
+        domain events the XML is parsed on every call.
+        """
+        uuid = domain.UUIDString()
+        topology = self._topology.get(uuid)
+        if topology is None:
+            generation = self._event_generation
+            tree = etree.fromstring(domain.XMLDesc(0))
+            topology = DomainTopology(
+                disks=tuple(self._get_disk_devices(tree)),
+                interfaces=tuple(self._get_interfaces(tree)))
+            if (self._domain_events and
+                    generation == self._event_generation):
+                self._topology[uuid] = topology
+        return topology
+
     def _lookup_by_name(self, instance_name):
+        domain = self._domains.pop(instance_name, None)
+        if domain is not None:
+            # Re-insert to mark the handle as the most recently used.
+            self._domains[instance_name] = domain
+            self.cache_stats['domain_hits'] += 1
+            return domain
+        self.cache_stats['domain_misses'] += 1
+        LOG.debug('Domain handle cache miss for %(name)s '
+                  '(hits=%(hits)d, misses=%(misses)d)',
+                  {'name': instance_name,
+                   'hits': self.cache_stats['domain_hits'],
+                   'misses': self.cache_stats['domain_misses']})
+        domain = self._lookup_domain(instance_name)
+        if CONF.libvirt_domain_cache_size > 0:
+            self._domains[instance_name] = domain
+            while len(self._domains) > CONF.libvirt_domain_cache_size:
+                self._domains.popitem(last=False)
+        return domain
+
+    def _evict_domain(self, instance_name):
+        if self._domains.pop(instance_name, None) is not None:
+            self.cache_stats['domain_evictions'] += 1
+        self._memory_usage.pop(instance_name, None)
+        self._no_balloon_stats.pop(instance_name, None)
+
+    @retry_on_disconnect
+    def _lookup_domain(self, instance_name):
         try:
             return self._get_connection().lookupByName(instance_name)
         except Exception as ex:
+            if isinstance(ex, virt_inspector.InspectorException):
+                raise
             if not libvirt or not isinstance(ex, libvirt.libvirtError):
                 raise virt_inspector.InspectorException(six.text_type(ex))
             error_code = ex.get_error_code()
-            if (error_code == libvirt.VIR_ERR_SYSTEM_ERROR and
-                ex.get_error_domain() in (libvirt.VIR_FROM_REMOTE,
-                                          libvirt.VIR_FROM_RPC)):
+            if _is_connection_broken(ex):
                 raise
             msg = ("Error from libvirt while looking up %(instance_name)s: "
                    "[Error Code %(error_code)s] "
@@ -103,14 +792,98 @@ class LibvirtInspector(virt_inspector.Inspector):
                                'ex': ex})
             raise virt_inspector.InstanceNotFoundException(msg)
 
+    @retry_on_disconnect
+    def _get_all_domain_stats(self):
+        conn = self._get_connection()
+        stats = (libvirt.VIR_DOMAIN_STATS_STATE |
+                 libvirt.VIR_DOMAIN_STATS_CPU_TOTAL |
+                 libvirt.VIR_DOMAIN_STATS_VCPU |
+                 libvirt.VIR_DOMAIN_STATS_BALLOON |
+                 libvirt.VIR_DOMAIN_STATS_BLOCK |
+                 libvirt.VIR_DOMAIN_STATS_INTERFACE)
+        records = conn.getAllDomainStats(stats)
+        return dict((domain.name(),
+                     DomainStats(domain=self._wrap_domain(domain),
+                                 state=record.get('state.state'),
+                                 stats=record,
+                                 block=_split_device_stats(record, 'block'),
+                                 net=_split_device_stats(record, 'net')))
+                    for domain, record in records)
+
+    def _get_domain_stats(self, instance_name):
+        """Return the bulk statistics of a domain, or None.
+
+        All the domains are collected at once and the snapshot is shared by
+        every inspect call until it is older than libvirt_bulk_stats_max_age.
+        None means bulk collection is disabled or unsupported, or that the
+        domain is not part of the current snapshot.
+        """
+        if not (CONF.libvirt_bulk_stats and self._bulk_stats_supported):
+            return None
+        now = time.time()
+        if (self._bulk_stats is None or
+                now - self._bulk_stats_time > CONF.libvirt_bulk_stats_max_age):
+            try:
+                self._bulk_stats = self._get_all_domain_stats()
+            except (AttributeError, libvirt.libvirtError) as e:
+                if (isinstance(e, libvirt.libvirtError) and
+                        e.get_error_code() != libvirt.VIR_ERR_NO_SUPPORT):
+                    raise
+                LOG.warn(_('libvirt does not support getAllDomainStats, '
+                           'falling back to per-domain calls'))
+                self._bulk_stats_supported = False
+                return None
+            self._bulk_stats_time = now
+        return self._bulk_stats.get(instance_name)
+
+    def _get_domain(self, instance_name, dom_stats=None):
+        if dom_stats is not None:
+            return dom_stats.domain
+        return self._lookup_by_name(instance_name)
+
+    @staticmethod
+    def _get_disk_devices(tree):
+        return filter(bool, [target.get("dev")
+                             for target in tree.findall('devices/disk/target')])
+
+    @staticmethod
+    def _get_interfaces(tree):
+        for iface in tree.findall('devices/interface'):
+            target = iface.find('target')
+            if target is not None:
+                name = target.get('dev')
+            else:
+                continue
+            mac = iface.find('mac')
+            if mac is not None:
+                mac_address = mac.get('address')
+            else:
+                continue
+            fref = iface.find('filterref')
+            if fref is not None:
+                fref = fref.get('filter')
+
+            params = dict((p.get('name').lower(), p.get('value'))
+                          for p in iface.findall('filterref/parameter'))
+            yield virt_inspector.Interface(name=name, mac=mac_address,
+                                           fref=fref, parameters=params)
+
     @retry_on_disconnect
     def inspect_instance(self, domain_id):
         domain = self._get_connection().lookupByID(domain_id)
         return virt_inspector.Instance(name=domain.name(),
                                        UUID=domain.UUIDString())
 
-    @retry_on_disconnect
     def inspect_instances(self):
+        inventory = self._get_inventory()
+        if inventory is None:
+            return self._list_instances()
+        return iter([entry.instance
+                     for entry in list(inventory.values())
+                     if entry.state != libvirt.VIR_DOMAIN_SHUTOFF])
+
+    @retry_on_disconnect
+    def _list_instances(self):
         if self._get_connection().numOfDomains() > 0:
             for domain_id in self._get_connection().listDomainsID():
                 if domain_id != 0:
@@ -120,112 +893,481 @@ class LibvirtInspector(virt_inspector.Inspector):
                         # Instance was deleted while listing... ignore it
                         pass
 
+    @evict_on_missing_domain
+    def inspect_snapshot(self, instance_name, fields=None, instance=None,
+                         duration=None, record=True):
+        # All the fields share a single domain lookup, info() and
+        # memoryStats() call, and the rates come from the counters read
+        # for the cumulative fields.
+        domain = _DomainContext(self, instance_name, record)
+        return self._build_snapshot(instance_name, fields, {
+            'cpu': lambda: self._inspect_cpus(domain),
+            'cpu_util': lambda: self._inspect_cpu_util(domain, duration),
+            'vcpu_util': lambda: list(self._inspect_vcpu_util(domain,
+                                                              duration)),
+            'memory_usage': lambda: self._inspect_memory_usage(domain),
+            'memory_resident': lambda: self._inspect_memory_resident(domain),
+            'memory_stats': lambda: self._inspect_memory_stats(domain),
+            'disks': lambda: self._inspect_disks(domain),
+            'disk_rates': lambda: list(self._inspect_disk_rates(domain,
+                                                                duration)),
+            'disk_info': lambda: self._inspect_disk_info(domain),
+            'vnics': lambda: self._inspect_vnics(domain),
+        })
+
+    def _record_counters(self, domain, kind, samples):
+        if domain.record:
+            self._counters.record((kind, domain.name), samples)
+
+    def _snapshot_field_failed(self, instance_name, field, ex):
+        # Left to evict_on_missing_domain, which evicts the domain or
+        # reconnects.
+        if _is_missing_domain(ex) or _is_connection_broken(ex):
+            raise ex
+        super(LibvirtInspector, self)._snapshot_field_failed(
+            instance_name, field, ex)
+
+    @evict_on_missing_domain
     def inspect_cpus(self, instance_name):
-        domain = self._lookup_by_name(instance_name)
-        dom_info = domain.info()
-        return virt_inspector.CPUStats(number=dom_info[3], time=dom_info[4])
+        return self._inspect_cpus(_DomainContext(self, instance_name))
+
+    def _inspect_cpus(self, domain):
+        if domain.stats is not None and 'cpu.time' in domain.stats.stats:
+            cpu_stats = virt_inspector.CPUStats(
+                number=domain.stats.stats.get('vcpu.current'),
+                time=domain.stats.stats['cpu.time'])
+        else:
+            dom_info = domain.info
+            cpu_stats = virt_inspector.CPUStats(number=dom_info[3],
+                                                time=dom_info[4])
+        self._record_counters(domain, 'cpu',
+                              [('cpu', cpu_stats.number, (cpu_stats.time,))])
+        return cpu_stats
+
+    @evict_on_missing_domain
+    def inspect_cpu_util(self, instance, duration=None):
+        return self._inspect_cpu_util(
+            _DomainContext(self, util.instance_name(instance)), duration)
+
+    def _inspect_cpu_util(self, domain, duration):
+        owner = ('cpu', domain.name)
+        if self._counters.age(owner) > CONF.libvirt_counter_max_age:
+            self._inspect_cpus(domain)
+        for number, rates in self._counters.rates(owner, duration):
+            if number:
+                # CPU time is in ns and shared by all the vCPUs.
+                cpu_util = rates[0] / (10.0 ** 9 * number) * 100
+                return virt_inspector.CPUUtilStats(util=min(cpu_util, 100.0))
+        return None
+
+    def _inspect_vcpus(self, domain):
+        """Return the (vCPU number, cumulative CPU time) of every vCPU."""
+        stats = domain.stats
+        if stats is not None and 'vcpu.maximum' in stats.stats:
+            vcpus = [(number, vcpu['time'])
+                     for number, vcpu in enumerate(_split_device_stats(
+                         stats.stats, 'vcpu', stats.stats['vcpu.maximum']))
+                     if 'time' in vcpu]
+        else:
+            if domain.state == libvirt.VIR_DOMAIN_SHUTOFF:
+                return []
+            try:
+                vcpus = [(info[0], info[2])
+                         for info in domain.domain.vcpus()[0]]
+            except libvirt.libvirtError as e:
+                if _is_missing_domain(e) or _is_connection_broken(e):
+                    raise
+                # vCPU times are only available for running domains.
+                return []
+        self._record_counters(domain, 'vcpu',
+                              [(number, number, (cpu_time,))
+                               for number, cpu_time in vcpus])
+        return vcpus
+
+    @evict_on_missing_domain
+    def inspect_vcpu_util(self, instance, duration=None):
+        return iter(list(self._inspect_vcpu_util(
+            _DomainContext(self, util.instance_name(instance)), duration)))
 
+    def _inspect_vcpu_util(self, domain, duration):
+        owner = ('vcpu', domain.name)
+        if self._counters.age(owner) > CONF.libvirt_counter_max_age:
+            self._inspect_vcpus(domain)
+        for number, rates in self._counters.rates(owner, duration):
+            cpu_util = rates[0] / 10.0 ** 9 * 100
+            yield virt_inspector.VCPUUtilStats(number=number,
+                                               util=min(cpu_util, 100.0))
+
+    @evict_on_missing_domain
     def inspect_disk_info(self, instance_name):
-        domain = self._lookup_by_name(instance_name)
-        #domain = self._get_domain_not_shut_off_or_raise(instance)
-        tree = etree.fromstring(domain.XMLDesc(0))
-        for device in filter(
-                bool,
-                [target.get("dev")
-                 for target in tree.findall('devices/disk/target')]):
-            disk = virt_inspector.Disk(device=device)
-            block_info = domain.blockInfo(device)
-            info = virt_inspector.DiskInfo(capacity=block_info[0],
-                                           allocation=block_info[1],
-                                           physical=block_info[2])
-
-            yield (disk, info)
+        return iter(self._inspect_disk_info(
+            _DomainContext(self, instance_name)))
+
+    def _inspect_disk_info(self, domain):
+        disk_info = []
+        if domain.stats is not None:
+            for block in domain.stats.block:
+                if not block.get('name'):
+                    continue
+                disk = virt_inspector.Disk(device=block['name'])
+                info = virt_inspector.DiskInfo(
+                    capacity=block.get('capacity', 0),
+                    allocation=block.get('allocation', 0),
+                    physical=block.get('physical', 0))
+                disk_info.append((disk, info))
+            return disk_info
+        return self._get_block_info(domain)
+
+    def _get_block_info(self, domain):
+        """Return the (Disk, DiskInfo) of every disk of a domain.
+
+        blockInfo can take tens of milliseconds per disk on network storage
+        while the sizes it returns change slowly, so they are cached across
+        polling cycles by domain UUID and device. A disk is read again once
+        it is older than libvirt_disk_info_refresh, and all of them once the
+        topology of the domain is invalidated or the disks it lists change.
+        Without domain events a resize would go unnoticed, so nothing is
+        cached.
+        """
+        now = _monotonic()
+        max_age = CONF.libvirt_disk_info_refresh
+        if not self._domain_events:
+            max_age = 0
+        generation = self._event_generation
+        uuid = domain.domain.UUIDString()
+        cached = self._block_info.get(uuid, {})
+        entries = {}
+        disk_info = []
+        for device in domain.topology.disks:
+            entry = cached.get(device)
+            if entry is None or now - entry[1] >= max_age:
+                self.cache_stats['block_info_misses'] += 1
+                block_info = domain.domain.blockInfo(device)
+                entry = (virt_inspector.DiskInfo(capacity=block_info[0],
+                                                 allocation=block_info[1],
+                                                 physical=block_info[2]),
+                         now)
+            else:
+                self.cache_stats['block_info_hits'] += 1
+            entries[device] = entry
+            disk_info.append((virt_inspector.Disk(device=device), entry[0]))
+        if max_age > 0 and generation == self._event_generation:
+            self._block_info[uuid] = entries
+            self._expire_block_info(now, max_age)
+        return disk_info
+
+    def _expire_block_info(self, now, max_age):
+        # Domains that went away without an undefine event are dropped
+        # once none of their disks was read for a while.
+        if now < self._block_info_expire_at:
+            return
+        self._block_info_expire_at = now + max_age
+        expiry = 2 * max_age
+        for uuid, entries in list(self._block_info.items()):
+            if all(now - fetched > expiry
+                   for info, fetched in entries.values()):
+                del self._block_info[uuid]
 
+    @evict_on_missing_domain
     def inspect_vnics(self, instance_name):
-        domain = self._lookup_by_name(instance_name)
-        state = domain.info()[0]
-        if state == libvirt.VIR_DOMAIN_SHUTOFF:
+        return iter(self._inspect_vnics(_DomainContext(self, instance_name)))
+
+    def _inspect_vnics(self, domain):
+        if domain.state == libvirt.VIR_DOMAIN_SHUTOFF:
             LOG.warn(_('Failed to inspect vnics of %(instance_name)s, '
                        'domain is in state of SHUTOFF'),
-                     {'instance_name': instance_name})
-            return
-        tree = etree.fromstring(domain.XMLDesc(0))
-        for iface in tree.findall('devices/interface'):
-            target = iface.find('target')
-            if target is not None:
-                name = target.get('dev')
+                     {'instance_name': domain.name})
+            return []
+        net_stats = {}
+        if domain.stats is not None:
+            net_stats = dict((net.get('name'), net)
+                             for net in domain.stats.net)
+        vnics = []
+        for interface in domain.topology.interfaces:
+            if domain.stats is not None:
+                net = net_stats.get(interface.name)
+                if net is None:
+                    continue
+                stats = virt_inspector.InterfaceStats(
+                    rx_bytes=net.get('rx.bytes', 0),
+                    rx_packets=net.get('rx.pkts', 0),
+                    tx_bytes=net.get('tx.bytes', 0),
+                    tx_packets=net.get('tx.pkts', 0))
             else:
-                continue
-            mac = iface.find('mac')
-            if mac is not None:
-                mac_address = mac.get('address')
-            else:
-                continue
-            fref = iface.find('filterref')
-            if fref is not None:
-                fref = fref.get('filter')
+                iface_stats = domain.domain.interfaceStats(interface.name)
+                stats = virt_inspector.InterfaceStats(
+                    rx_bytes=iface_stats[0],
+                    rx_packets=iface_stats[1],
+                    tx_bytes=iface_stats[4],
+                    tx_packets=iface_stats[5])
+            vnics.append((interface, stats))
+        self._record_counters(
+            domain, 'vnic',
+            [(interface.name, interface, (stats.rx_bytes, stats.tx_bytes))
+             for interface, stats in vnics])
+        return vnics
 
-            params = dict((p.get('name').lower(), p.get('value'))
-                          for p in iface.findall('filterref/parameter'))
-            interface = virt_inspector.Interface(name=name, mac=mac_address,
-                                                 fref=fref, parameters=params)
-            dom_stats = domain.interfaceStats(name)
-            stats = virt_inspector.InterfaceStats(rx_bytes=dom_stats[0],
-                                                  rx_packets=dom_stats[1],
-                                                  tx_bytes=dom_stats[4],
-                                                  tx_packets=dom_stats[5])
-            yield (interface, stats)
+    @evict_on_missing_domain
+    def inspect_vnic_rates(self, instance, duration=None):
+        return iter(list(self._inspect_vnic_rates(
+            _DomainContext(self, util.instance_name(instance)), duration)))
+
+    def _inspect_vnic_rates(self, domain, duration):
+        owner = ('vnic', domain.name)
+        if self._counters.age(owner) > CONF.libvirt_counter_max_age:
+            self._inspect_vnics(domain)
+        for interface, rates in self._counters.rates(owner, duration):
+            yield (interface,
+                   virt_inspector.InterfaceRateStats(rx_bytes_rate=rates[0],
+                                                     tx_bytes_rate=rates[1]))
 
+    @evict_on_missing_domain
     def inspect_disks(self, instance_name):
-        domain = self._lookup_by_name(instance_name)
-        state = domain.info()[0]
-        if state == libvirt.VIR_DOMAIN_SHUTOFF:
+        return iter(self._inspect_disks(_DomainContext(self, instance_name)))
+
+    def _inspect_disks(self, domain):
+        if domain.state == libvirt.VIR_DOMAIN_SHUTOFF:
             LOG.warn(_('Failed to inspect disks of %(instance_name)s, '
                        'domain is in state of SHUTOFF'),
-                     {'instance_name': instance_name})
-            return
-        tree = etree.fromstring(domain.XMLDesc(0))
-        for device in filter(
-                bool,
-                [target.get("dev")
-                 for target in tree.findall('devices/disk/target')]):
-            disk = virt_inspector.Disk(device=device)
-            block_stats = domain.blockStats(device)
-            stats = virt_inspector.DiskStats(read_requests=block_stats[0],
-                                             read_bytes=block_stats[1],
-                                             write_requests=block_stats[2],
-                                             write_bytes=block_stats[3],
-                                             errors=block_stats[4])
-            yield (disk, stats)
+                     {'instance_name': domain.name})
+            return []
+        disks = []
+        if domain.stats is not None:
+            # The bulk API has no error counter, report none.
+            for block in domain.stats.block:
+                if not block.get('name'):
+                    continue
+                disk = virt_inspector.Disk(device=block['name'])
+                stats = virt_inspector.DiskStats(
+                    read_requests=block.get('rd.reqs', 0),
+                    read_bytes=block.get('rd.bytes', 0),
+                    write_requests=block.get('wr.reqs', 0),
+                    write_bytes=block.get('wr.bytes', 0),
+                    errors=0)
+                disks.append((disk, stats))
+        else:
+            for device in domain.topology.disks:
+                disk = virt_inspector.Disk(device=device)
+                block_stats = domain.domain.blockStats(device)
+                stats = virt_inspector.DiskStats(
+                    read_requests=block_stats[0],
+                    read_bytes=block_stats[1],
+                    write_requests=block_stats[2],
+                    write_bytes=block_stats[3],
+                    errors=block_stats[4])
+                disks.append((disk, stats))
+        self._record_counters(
+            domain, 'disk',
+            [(disk.device, disk, (stats.read_bytes, stats.read_requests,
+                                  stats.write_bytes, stats.write_requests))
+             for disk, stats in disks])
+        return disks
+
+    @evict_on_missing_domain
+    def inspect_disk_rates(self, instance, duration=None):
+        return iter(list(self._inspect_disk_rates(
+            _DomainContext(self, util.instance_name(instance)), duration)))
 
+    def _inspect_disk_rates(self, domain, duration):
+        owner = ('disk', domain.name)
+        if self._counters.age(owner) > CONF.libvirt_counter_max_age:
+            self._inspect_disks(domain)
+        for disk, rates in self._counters.rates(owner, duration):
+            stats = virt_inspector.DiskRateStats(read_bytes_rate=rates[0],
+                                                 read_requests_rate=rates[1],
+                                                 write_bytes_rate=rates[2],
+                                                 write_requests_rate=rates[3])
+            yield (disk, stats)
 
+    @evict_on_missing_domain
     def inspect_memory_usage(self, instance_name, duration=None):
-        #domain = self._get_domain_not_shut_off_or_raise(instance)
-        domain = self._lookup_by_name(instance_name)
+        return self._inspect_memory_usage(
+            _DomainContext(self, instance_name))
+
+    def _inspect_memory_usage(self, domain):
+        """Return the memory usage of a domain from its balloon stats.
+
+        When the balloon stats are missing, the balloon stats period of the
+        domain is set if enabled, and the last usage read is returned for
+        up to libvirt_memory_stats_max_age seconds. None is returned after
+        that.
+        """
+        now = _monotonic()
+        memory_used = self._get_balloon_memory_usage(domain)
+        if memory_used is not None:
+            self._memory_usage[domain.name] = (memory_used, now)
+            self._no_balloon_stats.pop(domain.name, None)
+            return virt_inspector.MemoryUsageStats(usage=memory_used)
+        self._no_balloon_stats[domain.name] = now
+        self._enable_memory_stats(domain, now)
+        last = self._memory_usage.get(domain.name)
+        if last is not None:
+            if now - last[1] <= CONF.libvirt_memory_stats_max_age:
+                LOG.debug('Reporting the memory usage of %(instance_name)s '
+                          'read %(age)d seconds ago',
+                          {'instance_name': domain.name,
+                           'age': now - last[1]})
+                return virt_inspector.MemoryUsageStats(usage=last[0])
+            del self._memory_usage[domain.name]
+        return None
+
+    def _get_balloon_memory_usage(self, domain):
+        if domain.stats is not None:
+            balloon_stats = domain.stats.stats
+            if (balloon_stats.get('balloon.available') and
+                    balloon_stats.get('balloon.unused')):
+                memory_used = (balloon_stats['balloon.available'] -
+                               balloon_stats['balloon.unused'])
+                # Stat provided from libvirt is in KB, converting it to MB.
+                return memory_used / units.Ki
+        instance_name = domain.name
         try:
-            memory_stats = domain.memoryStats()
-            if (memory_stats and memory_stats.get('available') and  memory_stats.get('unused')):
-                memory_used = (memory_stats.get('available') - memory_stats.get('unused'))
+            memory_stats = domain.memory_stats
+            if (memory_stats and memory_stats.get('available') and
+                    memory_stats.get('unused')):
+                memory_used = (memory_stats.get('available') -
+                               memory_stats.get('unused'))
                 # Stat provided from libvirt is in KB, converting it to MB.
-                memory_used = memory_used / units.Ki
-                return virt_inspector.MemoryUsageStats(usage=memory_used)
-            else:
-                msg = _('Failed to inspect memory usage of instance '
-                        '<name=%(name)s, id=%(id)s>, '
-                        'can not get info from libvirt.') % {
-                    'name': instance_name, 'id': instance_name}
-                #raise virt_inspector.NoDataException(msg)
+                return memory_used / units.Ki
+            LOG.debug('Failed to inspect memory usage of %(instance_name)s, '
+                      'no balloon stats from libvirt',
+                      {'instance_name': instance_name})
         # memoryStats might launch an exception if the method is not supported
         # by the underlying hypervisor being used by libvirt.
         except libvirt.libvirtError as e:
-            msg = _('Failed to inspect memory usage of %(instance_uuid)s, '
-                    'can not get info from libvirt: %(error)s') % {
-                'instance_uuid': instance_name, 'error': e}
-            #raise virt_inspector.NoDataException(msg)
+            if _is_missing_domain(e) or _is_connection_broken(e):
+                raise
+            LOG.debug('Failed to inspect memory usage of %(instance_name)s, '
+                      'can not get info from libvirt: %(error)s',
+                      {'instance_name': instance_name, 'error': e})
+        return None
+
+    def _enable_memory_stats(self, domain, now):
+        """Set the balloon stats period of a domain lacking balloon stats.
 
+        It is set once per run of the domain, and again when the stats are
+        still missing long after, as after a restart libvirt did not report.
+        """
+        period = CONF.libvirt_memory_stats_period
+        if period <= 0:
+            return
+        uuid = domain.domain.UUIDString()
+        set_at = self._stats_period_set.get(uuid)
+        if set_at is not None and now - set_at < 2 * period + 60:
+            return
+        self._stats_period_set[uuid] = now
+        try:
+            rw_domain = self._get_rw_connection().lookupByUUIDString(uuid)
+            rw_domain.setMemoryStatsPeriod(period,
+                                           libvirt.VIR_DOMAIN_AFFECT_LIVE)
+        except (AttributeError, libvirt.libvirtError) as e:
+            LOG.warn(_('Unable to set the memory stats period of '
+                       '%(instance_name)s: %(error)s'),
+                     {'instance_name': domain.name, 'error': e})
+        else:
+            LOG.info(_('Balloon stats period of %(instance_name)s set to '
+                       '%(period)d seconds'),
+                     {'instance_name': domain.name, 'period': period})
 
+    def inspect_domains_without_balloon_stats(self):
+        # Domains not inspected for an hour are assumed gone.
+        now = _monotonic()
+        for instance_name, seen in list(self._no_balloon_stats.items()):
+            if now - seen > CounterHistory.EXPIRY:
+                del self._no_balloon_stats[instance_name]
+        return len(self._no_balloon_stats)
+
+    @evict_on_missing_domain
     def inspect_memory_resident(self, instance_name, duration=None):
+        return self._inspect_memory_resident(
+            _DomainContext(self, instance_name))
+
+    def _inspect_memory_resident(self, domain):
+        if domain.stats is not None and 'balloon.rss' in domain.stats.stats:
+            memory = domain.stats.stats['balloon.rss'] / units.Ki
+            return virt_inspector.MemoryResidentStats(resident=memory)
         #domain = self._get_domain_not_shut_off_or_raise(instance)
-        domain = self._lookup_by_name(instance_name)
-        memory = domain.memoryStats()['rss'] / units.Ki
+        memory = domain.memory_stats['rss'] / units.Ki
         return virt_inspector.MemoryResidentStats(resident=memory)
+
+    @evict_on_missing_domain
+    def inspect_memory_stats(self, instance_name):
+        return self._inspect_memory_stats(_DomainContext(self, instance_name))
+
+    def _inspect_memory_stats(self, domain):
+        # Keys of memoryStats() and their bulk statistics counterparts.
+        keys = [('available', 'balloon.available'),
+                ('unused', 'balloon.unused'),
+                ('rss', 'balloon.rss'),
+                ('actual', 'balloon.current'),
+                ('swap_in', 'balloon.swap_in'),
+                ('swap_out', 'balloon.swap_out'),
+                ('major_fault', 'balloon.major_fault'),
+                ('minor_fault', 'balloon.minor_fault')]
+        if (domain.stats is not None and
+                'balloon.current' in domain.stats.stats):
+            stats = dict((key, domain.stats.stats.get(bulk_key))
+                         for key, bulk_key in keys)
+        else:
+            stats = domain.memory_stats
+        # Memory and swap sizes are in KB, converting them to MB.
+        values = dict((key, stats.get(key)) for key, bulk_key in keys)
+        for key in ('available', 'unused', 'rss', 'actual',
+                    'swap_in', 'swap_out'):
+            if values[key] is not None:
+                values[key] = values[key] / units.Ki
+        return virt_inspector.MemoryStats(**values)
+
+    @retry_on_disconnect
+    def inspect_host_capacity(self):
+        conn = self._get_connection()
+        # model, memory (MB), CPUs, MHz, NUMA nodes, sockets, cores, threads
+        node_info = conn.getInfo()
+        free_memory = conn.getFreeMemory()
+        inventory = self._get_inventory()
+        if inventory is not None:
+            names = list(inventory)
+        else:
+            names = [domain.name() for domain in conn.listAllDomains()
+                     if domain.ID() != 0]
+        vcpus_used = vcpus_allocated = memory_allocated = disk_allocated = 0
+        for instance_name in names:
+            domain = _DomainContext(self, instance_name)
+            try:
+                stats = domain.stats.stats if domain.stats else {}
+                if ('balloon.maximum' in stats and
+                        'vcpu.maximum' in stats):
+                    max_memory = stats['balloon.maximum']
+                    vcpus = stats['vcpu.maximum']
+                else:
+                    max_memory = domain.info[1]
+                    vcpus = domain.info[3]
+                running = domain.state != libvirt.VIR_DOMAIN_SHUTOFF
+                capacity = sum(info.capacity for disk, info
+                               in self._inspect_disk_info(domain))
+            except virt_inspector.InstanceNotFoundException:
+                continue
+            except libvirt.libvirtError as e:
+                if _is_missing_domain(e):
+                    # Undefined since it was listed.
+                    continue
+                if _is_connection_broken(e):
+                    raise
+                LOG.warn(_('Failed to inspect %(instance_name)s for the '
+                           'host capacity, skipping it: %(error)s'),
+                         {'instance_name': instance_name, 'error': e})
+                continue
+            memory_allocated += max_memory
+            vcpus_allocated += vcpus
+            if running:
+                vcpus_used += vcpus
+            disk_allocated += capacity
+        # Domain memory is in KB, free memory in bytes.
+        return virt_inspector.HostCapacity(
+            memory_total=node_info[1],
+            memory_free=free_memory / units.Mi,
+            vcpus_total=node_info[2],
+            vcpus_used=vcpus_used,
+            vcpus_allocated=vcpus_allocated,
+            memory_allocated=memory_allocated / units.Ki,
+            disk_allocated=disk_allocated / units.Gi)
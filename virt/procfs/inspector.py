@@ -0,0 +1,248 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Implementation of Inspector abstraction reading QEMU processes in procfs.
+
+The statistics are read from the files procfs exposes for the QEMU process
+of each instance, without any libvirt call. What procfs cannot provide is
+inspected by LibvirtInspector.
+"""
+
+import os
+import re
+
+from oslo.config import cfg
+
+from ceilometer.compute.virt import inspector as virt_inspector
+from ceilometer.compute.virt.libvirt import inspector as libvirt_inspector
+from ceilometer.openstack.common import log as logging
+from oslo_utils import units
+
+LOG = logging.getLogger(__name__)
+
+procfs_opts = [
+    cfg.StrOpt('procfs_root',
+               default='/proc',
+               help='Mount point of procfs, where the statistics of the QEMU '
+                    'processes are read.'),
+    cfg.StrOpt('procfs_libvirt_run_dir',
+               default='/var/run/libvirt/qemu',
+               help='Directory where libvirt writes the PID of the QEMU '
+                    'process of each instance, in <instance name>.pid.'),
+    cfg.BoolOpt('procfs_disk_io',
+                default=False,
+                help='Report the I/O of the whole QEMU process, read from '
+                     '/proc/<pid>/io, as a single disk named "total" instead '
+                     'of the per-disk statistics of libvirt. It misses the '
+                     'storage QEMU accesses over the network itself, such '
+                     'as rbd, and the disk rates still come from libvirt.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(procfs_opts)
+
+# Names of the QEMU threads running the vCPUs of KVM guests.
+_VCPU_THREAD = re.compile(r'^CPU \d+/KVM$')
+
+# Errors of a process exiting or unreadable while being read.
+_READ_ERRORS = (IOError, OSError, ValueError, IndexError, KeyError)
+
+
+class ProcfsInspector(virt_inspector.Inspector):
+
+    def __init__(self):
+        self._libvirt = libvirt_inspector.LibvirtInspector()
+        # instance name -> (PID, start time) of its QEMU process
+        self._processes = {}
+        self._ns_per_tick = 10 ** 9 // os.sysconf('SC_CLK_TCK')
+
+    def _read(self, pid, name):
+        with open(os.path.join(CONF.procfs_root, str(pid), name)) as f:
+            return f.read()
+
+    def _read_stat(self, pid):
+        """Return the utime, stime and start time of a process, in ticks."""
+        stat = self._read(pid, 'stat')
+        # The command name may contain spaces, the fields follow its ')'
+        # starting with the third one.
+        fields = stat[stat.rindex(')') + 2:].split()
+        return int(fields[11]), int(fields[12]), int(fields[19])
+
+    def _find_process(self, instance_name):
+        """Return the PID of the QEMU process of an instance and its stat.
+
+        The PID is read from the libvirt pidfile the first time, then kept
+        as long as a process with that PID and start time exists.
+        """
+        process = self._processes.get(instance_name)
+        if process is not None:
+            pid, start_time = process
+            try:
+                stat = self._read_stat(pid)
+                if stat[2] == start_time:
+                    return pid, stat
+            except _READ_ERRORS:
+                pass
+            del self._processes[instance_name]
+        path = os.path.join(CONF.procfs_libvirt_run_dir,
+                            '%s.pid' % instance_name)
+        try:
+            with open(path) as f:
+                pid = int(f.read().strip())
+            stat = self._read_stat(pid)
+        except _READ_ERRORS as e:
+            LOG.debug('No QEMU process found for %(instance_name)s: '
+                      '%(error)s',
+                      {'instance_name': instance_name, 'error': e})
+            return None, None
+        self._processes[instance_name] = (pid, stat[2])
+        return pid, stat
+
+    def _from_process(self, instance_name, read):
+        """Return read(pid, stat) for the QEMU process of an instance.
+
+        None is returned when the process cannot be found or read, for the
+        caller to fall back to libvirt.
+        """
+        pid, stat = self._find_process(instance_name)
+        if pid is None:
+            return None
+        try:
+            return read(pid, stat)
+        except _READ_ERRORS as e:
+            LOG.debug('Failed to read the QEMU process of %(instance_name)s: '
+                      '%(error)s',
+                      {'instance_name': instance_name, 'error': e})
+            self._processes.pop(instance_name, None)
+            return None
+
+    def _read_cpus(self, pid, stat):
+        task_dir = os.path.join(CONF.procfs_root, str(pid), 'task')
+        number = 0
+        for tid in os.listdir(task_dir):
+            if _VCPU_THREAD.match(self._read(pid, 'task/%s/comm' % tid)
+                                  .strip()):
+                number += 1
+        if not number:
+            # Not a KVM guest, or its vCPU threads are not named.
+            return None
+        return virt_inspector.CPUStats(
+            number=number, time=(stat[0] + stat[1]) * self._ns_per_tick)
+
+    def _read_memory_resident(self, pid, stat):
+        for line in self._read(pid, 'status').splitlines():
+            if line.startswith('VmRSS:'):
+                # The size is in kB, converting it to MB.
+                memory = int(line.split()[1]) / units.Ki
+                return virt_inspector.MemoryResidentStats(resident=memory)
+        return None
+
+    def _read_disks(self, pid, stat):
+        io = dict(line.split(':', 1)
+                  for line in self._read(pid, 'io').splitlines()
+                  if ':' in line)
+        stats = virt_inspector.DiskStats(
+            read_bytes=int(io['read_bytes']),
+            read_requests=int(io['syscr']),
+            write_bytes=int(io['write_bytes']),
+            write_requests=int(io['syscw']),
+            errors=0)
+        return [(virt_inspector.Disk(device='total'), stats)]
+
+    def _process_fields(self):
+        """Return the snapshot fields read from procfs and their readers."""
+        fields = [('cpu', self._read_cpus),
+                  ('memory_resident', self._read_memory_resident)]
+        if CONF.procfs_disk_io:
+            fields.append(('disks', self._read_disks))
+        return fields
+
+    def inspect_instances(self):
+        instances = list(self._libvirt.inspect_instances())
+        # Forget the processes of the instances that went away.
+        names = set(instance.name for instance in instances)
+        for instance_name in list(self._processes):
+            if instance_name not in names:
+                del self._processes[instance_name]
+        return iter(instances)
+
+    def inspect_snapshot(self, instance_name, fields=None, instance=None,
+                         duration=None, record=True):
+        if fields is None:
+            fields = virt_inspector.SNAPSHOT_FIELDS
+        values = {}
+        for field, read in self._process_fields():
+            if field in fields:
+                value = self._from_process(instance_name, read)
+                if value is not None:
+                    values[field] = value
+        remaining = [field for field in fields if field not in values]
+        if not remaining:
+            return virt_inspector.InstanceSnapshot(
+                *[values.get(field)
+                  for field in virt_inspector.SNAPSHOT_FIELDS])
+        snapshot = self._libvirt.inspect_snapshot(
+            instance_name, fields=remaining, instance=instance,
+            duration=duration, record=record)
+        return snapshot._replace(**values)
+
+    def inspect_cpus(self, instance_name):
+        stats = self._from_process(instance_name, self._read_cpus)
+        if stats is None:
+            return self._libvirt.inspect_cpus(instance_name)
+        return stats
+
+    def inspect_memory_resident(self, instance_name, duration=None):
+        stats = self._from_process(instance_name, self._read_memory_resident)
+        if stats is None:
+            return self._libvirt.inspect_memory_resident(instance_name,
+                                                         duration)
+        return stats
+
+    def inspect_disks(self, instance_name):
+        disks = None
+        if CONF.procfs_disk_io:
+            disks = self._from_process(instance_name, self._read_disks)
+        if disks is None:
+            return self._libvirt.inspect_disks(instance_name)
+        return iter(disks)
+
+    # What procfs cannot provide is inspected by libvirt.
+
+    def inspect_disk_info(self, instance):
+        return self._libvirt.inspect_disk_info(instance)
+
+    def inspect_cpu_util(self, instance, duration=None):
+        return self._libvirt.inspect_cpu_util(instance, duration)
+
+    def inspect_vcpu_util(self, instance, duration=None):
+        return self._libvirt.inspect_vcpu_util(instance, duration)
+
+    def inspect_vnics(self, instance_name):
+        return self._libvirt.inspect_vnics(instance_name)
+
+    def inspect_vnic_rates(self, instance, duration=None):
+        return self._libvirt.inspect_vnic_rates(instance, duration)
+
+    def inspect_memory_usage(self, instance_name, duration=None):
+        return self._libvirt.inspect_memory_usage(instance_name, duration)
+
+    def inspect_memory_stats(self, instance_name):
+        return self._libvirt.inspect_memory_stats(instance_name)
+
+    def inspect_disk_rates(self, instance, duration=None):
+        return self._libvirt.inspect_disk_rates(instance, duration)
+
+    def inspect_domains_without_balloon_stats(self):
+        return self._libvirt.inspect_domains_without_balloon_stats()
+
+    def inspect_host_capacity(self):
+        return self._libvirt.inspect_host_capacity()